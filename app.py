@@ -1,22 +1,50 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, send_from_directory, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-import qrcode
+import hashlib
+import logging
 import os
+import time
 from werkzeug.utils import secure_filename
-import base64
-from io import BytesIO
 import numpy as np
+import click
 import json
-from numpy.linalg import norm
+import re
+import threading
+from collections import OrderedDict
 from flask_wtf.csrf import CSRFProtect, generate_csrf
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+from face_index import FaceIndex, encode_descriptor, make_backend, matrix_from_blobs, parse_face_encoding
+from migrations import upgrade as upgrade_database
+from geocoding import PENDING_LOCATION, GeocodingService, LocationStore, make_provider
+from geofence import GeofenceCache, parse_rooms
+from qr_cache import FORMATS as QR_FORMATS, QRCodeCache
+from model_assets import ENCODINGS as MODEL_ENCODINGS, ModelAssets
+from storage import WriteBehindQueue, configure_sqlite, database_uri, engine_options
+from ingest import IngestionPipeline, QueueFull
+from shared_index import SharedFaceMatrix
+from instrumentation import instrument_engine, registry as metrics, span
+import attendance_export
+import student_import
+import face_quality
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_pyfile('config.py')
 
+logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('attendance')
+metrics.enabled = app.config['METRICS_ENABLED']
+
+# DATABASE_URL switches the same models to another database such as PostgreSQL
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(app.config['SQLALCHEMY_DATABASE_URI'], os.environ)
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS']
+))
+
 # Initialize CSRF protection
 csrf = CSRFProtect(app)
 
@@ -25,17 +53,43 @@ csrf = CSRFProtect(app)
 def inject_csrf_token():
     return dict(csrf_token=generate_csrf)
 
+# Fingerprinted model files, when download_models.py has built them
+model_assets = ModelAssets(app.config['MODEL_ASSET_DIR'])
+
+# URLs of the hashed weights manifests, so pages load models that can be cached forever
+@app.context_processor
+def inject_model_urls():
+    models = model_assets.manifest()['models']
+    return dict(model_urls={model: url_for('serve_model', filename=path) for model, path in models.items()})
+
 # Initialize database
 db = SQLAlchemy(app)
 
+with app.app_context():
+    configure_sqlite(
+        db.engine,
+        journal_mode=app.config['SQLITE_JOURNAL_MODE'],
+        synchronous=app.config['SQLITE_SYNCHRONOUS'],
+        busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS']
+    )
+    instrument_engine(db.engine)
+
 # Models
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.String(10), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
-    face_encoding = db.Column(db.Text, nullable=True)
+    face_encoding = db.Column(db.Text, nullable=True)  # Legacy JSON encoding, migrated to face_embedding
+    face_embedding = db.Column(db.LargeBinary, nullable=True)  # Binary descriptor, see face_index.encode_descriptor
+    # Distance to the closest other enrolled face and whose it is, see face_quality
+    face_margin = db.Column(db.Float, nullable=True)
+    face_neighbor_id = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @property
+    def has_face(self):
+        return bool(self.face_embedding or self.face_encoding)
+
 class Session(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -43,19 +97,258 @@ class Session(db.Model):
     classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), nullable=False)
     qr_code = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    roster_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every change to the session's own roster
 
 class Attendance(db.Model):
+    __table_args__ = (
+        # One mark per student per session; also serves session_id lookups
+        db.Index('uq_attendance_session_student', 'session_id', 'student_id', unique=True),
+        # Per-student attendance history
+        db.Index('ix_attendance_student_timestamp', 'student_id', 'timestamp'),
+        # Offline clients replay submissions under the same key
+        db.Index('uq_attendance_client_key', 'client_key', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     session_id = db.Column(db.Integer, db.ForeignKey('session.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    client_key = db.Column(db.String(64), nullable=True)  # Idempotency key from the submitting client
+
+class SessionStats(db.Model):
+    # Running attendance totals per session, updated in the same transaction as each mark
+    __tablename__ = 'session_stats'
+    session_id = db.Column(db.Integer, db.ForeignKey('session.id'), primary_key=True)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    in_classroom = db.Column(db.Integer, nullable=False, default=0)
+    first_mark_at = db.Column(db.DateTime, nullable=True)
+    last_mark_at = db.Column(db.DateTime, nullable=True)
 
 class Classroom(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     coordinates = db.Column(db.Text, nullable=False)  # Store coordinates as a JSON string
+    roster_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every change to the classroom roster
+
+class LocationName(db.Model):
+    # Reverse-geocoding cache keyed by geohash cell
+    __tablename__ = 'location_cache'
+    geohash = db.Column(db.String(12), primary_key=True)
+    name = db.Column(db.Text, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Enrollment(db.Model):
+    # A student on the roster of a classroom (every session held there) or of a single session
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), nullable=True, index=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('session.id'), nullable=True, index=True)
+
+# In-memory index of enrolled face descriptors used by find_matching_student
+def create_face_index_backend():
+    if app.config['FACE_INDEX_BACKEND'] == 'ivf':
+        return make_backend(
+            'ivf',
+            nlist=app.config['FACE_INDEX_IVF_NLIST'],
+            nprobe=app.config['FACE_INDEX_IVF_NPROBE'],
+            min_train_size=app.config['FACE_INDEX_IVF_MIN_TRAIN_SIZE'],
+            path=app.config['FACE_INDEX_IVF_PATH']
+        )
+    return make_backend(app.config['FACE_INDEX_BACKEND'])
+
+face_index = FaceIndex(backend=create_face_index_backend())
+
+# In 'shared' mode the matrix is mapped from files published by whichever worker last changed it
+shared_faces = SharedFaceMatrix(app.config['FACE_INDEX_SHARED_DIR']) if app.config['FACE_INDEX_MODE'] == 'shared' else None
+shared_faces_generation = None
+shared_faces_lock = threading.Lock()
+
+# Reverse geocoding with a persistent cache; Nominatim allows about one request per second
+def create_geocoding_provider():
+    if app.config['GEOCODER_PROVIDER'] == 'nominatim':
+        return make_provider('nominatim', user_agent=app.config['GEOCODER_USER_AGENT'])
+    return make_provider(app.config['GEOCODER_PROVIDER'])
+
+geocoder = GeocodingService(
+    create_geocoding_provider(),
+    LocationStore(app, db, LocationName),
+    precision=app.config['GEOCODER_PRECISION'],
+    max_workers=app.config['GEOCODER_MAX_WORKERS'],
+    min_interval=app.config['GEOCODER_MIN_INTERVAL']
+)
+
+# Rendered session QR codes, cached in memory and on disk
+qr_codes = QRCodeCache(
+    app.config['QR_CACHE_DIR'],
+    max_entries=app.config['QR_CACHE_MAX_ENTRIES'],
+    max_workers=app.config['QR_RENDER_WORKERS']
+)
+
+# Classroom polygons compiled once into NumPy arrays, keyed by classroom id
+geofences = GeofenceCache()
+
+# Hot-path counters and latency histograms, exposed at /metrics
+face_match_results = metrics.counter('attendance_face_matches_total', 'Submitted faces by match outcome')
+attendance_results = metrics.counter('attendance_marks_total', 'Attendance submissions by result')
+out_of_classroom_marks = metrics.counter('attendance_out_of_classroom_total', 'Attendance marked outside the classroom geofence')
+request_seconds = metrics.histogram('attendance_http_request_seconds', 'HTTP request latency by endpoint')
+metrics.gauge('attendance_face_index_size', 'Enrolled faces in this process\'s face index', lambda: len(face_index))
+
+# Roster indexes keyed by (classroom id, session id or None), least recently used first.
+# Each holds the face index version and roster versions it was built from.
+roster_indexes = OrderedDict()
+roster_indexes_lock = threading.Lock()
+
+def read_face_matrix():
+    """Read every enrolled descriptor; returns (matrix, student primary keys)"""
+    rows = db.session.query(Student.id, Student.face_embedding).filter(
+        Student.face_embedding.isnot(None)).all()
+    ids = np.array([student_pk for student_pk, _ in rows], dtype=np.int64)
+    matrix, valid = matrix_from_blobs([blob for _, blob in rows])
+    for student_pk in ids[~valid]:
+        logger.warning(f"Skipping unreadable face embedding for student {student_pk}")
+    ids = ids[valid]
+    
+    # Rows that have not been migrated to the binary format yet
+    legacy_rows = []
+    for student_pk, face_encoding in db.session.query(Student.id, Student.face_encoding).filter(
+            Student.face_embedding.is_(None), Student.face_encoding.isnot(None)):
+        try:
+            legacy_rows.append((student_pk, parse_face_encoding(face_encoding)))
+        except Exception as e:
+            logger.warning(f"Skipping unreadable face encoding for student {student_pk}: {str(e)}")
+    if legacy_rows:
+        matrix = np.vstack([matrix] + [vector.reshape(1, -1) for _, vector in legacy_rows])
+        ids = np.concatenate([ids, np.array([student_pk for student_pk, _ in legacy_rows], dtype=np.int64)])
+    return matrix, ids
+
+def load_face_index():
+    """Build the face index from every enrolled student"""
+    if shared_faces is not None:
+        publish_face_index()
+        return
+    face_index.load_matrix(*read_face_matrix())
+    logger.info(f"Face index loaded with {len(face_index)} students")
+
+def publish_face_index():
+    """Rebuild the shared matrix from the database and map the new generation"""
+    with shared_faces.publishing():
+        generation = shared_faces.publish(*read_face_matrix())
+        # Only the publisher trains IVF centroids, once, under the lock; other workers load them
+        map_shared_face_index(generation, train=True)
+    logger.info(f"Published face index generation {generation} with {len(face_index)} students")
+
+def map_shared_face_index(generation, train=False):
+    global shared_faces_generation
+    with shared_faces_lock:
+        for attempt in range(5):
+            if generation == shared_faces_generation:
+                return
+            try:
+                face_index.load_matrix(*shared_faces.load(generation), train=train)
+                shared_faces_generation = generation
+                return
+            except FileNotFoundError:
+                # Newer publishes removed this generation since it was read; map the current one
+                current = shared_faces.current_generation()
+                if current is None or attempt == 4:
+                    raise
+                generation = current
+
+def get_face_index():
+    if shared_faces is not None:
+        # Remap when another worker has published a newer generation
+        generation = shared_faces.current_generation()
+        if generation is None:
+            publish_face_index()
+        elif generation != shared_faces_generation:
+            map_shared_face_index(generation)
+    elif not face_index.loaded:
+        # Build lazily when the app is served by something other than __main__
+        load_face_index()
+    return face_index
+
+def index_student(student_pk, descriptor):
+    """Make a newly saved descriptor matchable in this and (in shared mode) every other worker"""
+    if shared_faces is not None:
+        publish_face_index()
+    else:
+        get_face_index().add(student_pk, descriptor)
+
+def index_students(student_pks, matrix):
+    """Bulk index_student, used after an import"""
+    if shared_faces is not None:
+        publish_face_index()
+    else:
+        get_face_index().add_many(student_pks, matrix)
+
+def unindex_student(student_pk):
+    if shared_faces is not None:
+        publish_face_index()
+    else:
+        get_face_index().remove(student_pk)
+
+def get_roster_student_pks(session):
+    """Student primary keys enrolled in the session itself or in its classroom"""
+    rows = db.session.query(Enrollment.student_id).filter(
+        db.or_(Enrollment.session_id == session.id, Enrollment.classroom_id == session.classroom_id)
+    ).distinct()
+    return [student_pk for (student_pk,) in rows]
+
+def get_roster_index(session):
+    """
+    Return the candidate index for a session's roster, or None when the session
+    has no roster (in which case the whole institution is searched).
+    
+    Sessions without a roster of their own share their classroom's index. The
+    roster versions are read from the database, so a roster changed through
+    any worker is rebuilt here on the next lookup.
+    """
+    index = get_face_index()
+    classroom_version = db.session.query(Classroom.roster_version).filter_by(id=session.classroom_id).scalar()
+    key = (session.classroom_id, session.id if session.roster_version else None)
+    versions = (index.version, classroom_version, session.roster_version)
+    with roster_indexes_lock:
+        cached = roster_indexes.get(key)
+        if cached is not None and cached[0] == versions:
+            roster_indexes.move_to_end(key)
+            return cached[1]
+    
+    student_pks = get_roster_student_pks(session)
+    roster_index = index.subset(student_pks) if student_pks else None
+    with roster_indexes_lock:
+        roster_indexes[key] = (versions, roster_index)
+        roster_indexes.move_to_end(key)
+        while len(roster_indexes) > app.config['ROSTER_INDEX_CACHE_SIZE']:
+            roster_indexes.popitem(last=False)
+    return roster_index
+
+def bump_roster_version(classroom_id=None, session_id=None):
+    """Mark a roster as changed so every worker rebuilds its index; the caller commits"""
+    if classroom_id is not None:
+        db.session.execute(db.update(Classroom).where(Classroom.id == classroom_id).values(
+            roster_version=Classroom.roster_version + 1))
+    if session_id is not None:
+        db.session.execute(db.update(Session).where(Session.id == session_id).values(
+            roster_version=Session.roster_version + 1))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None and metrics.enabled:
+        request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unmatched')
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Routes
 @app.route('/')
@@ -64,9 +357,110 @@ def index():
 
 @app.route('/admin')
 def admin_dashboard():
-    students = Student.query.all()
-    sessions = Session.query.all()
-    return render_template('admin/dashboard.html', students=students, sessions=sessions)
+    # Student and session lists are loaded page by page from the JSON API below
+    classrooms = db.session.query(Classroom.id, Classroom.name).order_by(Classroom.name).all()
+    return render_template('admin/dashboard.html', classrooms=classrooms,
+                           page_size=app.config['DASHBOARD_PAGE_SIZE'])
+
+def get_page_size():
+    limit = request.args.get('limit', app.config['DASHBOARD_PAGE_SIZE'], type=int)
+    return min(max(limit, 1), app.config['DASHBOARD_MAX_PAGE_SIZE'])
+
+def paginate_students(search=None, before=None, limit=25):
+    """
+    Keyset-paginated students, newest first.
+    Returns (items, next_cursor); pass next_cursor back as before for the next page.
+    """
+    has_face = db.or_(Student.face_embedding.isnot(None), Student.face_encoding.isnot(None))
+    query = db.session.query(
+        Student.id, Student.student_id, Student.name, Student.created_at, has_face.label('has_face'))
+    if search:
+        pattern = f"%{search}%"
+        query = query.filter(db.or_(Student.name.ilike(pattern), Student.student_id.like(pattern)))
+    if before:
+        query = query.filter(Student.id < before)
+    rows = query.order_by(Student.id.desc()).limit(limit + 1).all()
+    
+    items = [{
+        'id': row.id,
+        'student_id': row.student_id,
+        'name': row.name,
+        'has_face': bool(row.has_face),
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    } for row in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    return items, next_cursor
+
+def paginate_sessions(search=None, classroom_id=None, date_from=None, date_to=None, before=None, limit=25):
+    """
+    Keyset-paginated sessions, newest first, with classroom names and attendance
+    counts. Counts for the whole page come from a single GROUP BY query.
+    """
+    query = db.session.query(
+        Session.id, Session.name, Session.date, Session.classroom_id, Classroom.name.label('classroom_name')
+    ).outerjoin(Classroom, Classroom.id == Session.classroom_id)
+    if search:
+        query = query.filter(Session.name.ilike(f"%{search}%"))
+    if classroom_id:
+        query = query.filter(Session.classroom_id == classroom_id)
+    if date_from:
+        query = query.filter(Session.date >= date_from)
+    if date_to:
+        query = query.filter(Session.date <= date_to)
+    if before:
+        query = query.filter(Session.id < before)
+    rows = query.order_by(Session.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    counts = {}
+    if rows:
+        counts = dict(db.session.query(Attendance.session_id, db.func.count(Attendance.id)).filter(
+            Attendance.session_id.in_([row.id for row in rows])
+        ).group_by(Attendance.session_id).all())
+    
+    items = [{
+        'id': row.id,
+        'name': row.name,
+        'date': row.date.strftime('%Y-%m-%d'),
+        'classroom_id': row.classroom_id,
+        'classroom_name': row.classroom_name,
+        'attendance_count': counts.get(row.id, 0),
+        'qr_url': url_for('session_qr', session_id=row.id, fmt='png'),
+        'attendance_url': url_for('attendance', session_id=row.id),
+        'records_url': url_for('session_attendance', session_id=row.id)
+    } for row in rows]
+    next_cursor = items[-1]['id'] if has_more else None
+    return items, next_cursor
+
+@app.route('/api/admin/students')
+def api_admin_students():
+    items, next_cursor = paginate_students(
+        search=request.args.get('q'),
+        before=request.args.get('before', type=int),
+        limit=get_page_size()
+    )
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@app.route('/api/admin/sessions')
+def api_admin_sessions():
+    try:
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+    
+    items, next_cursor = paginate_sessions(
+        search=request.args.get('q'),
+        classroom_id=request.args.get('classroom_id', type=int),
+        date_from=date_from,
+        date_to=date_to,
+        before=request.args.get('before', type=int),
+        limit=get_page_size()
+    )
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 @app.route('/admin/students/new', methods=['GET', 'POST'])
 @csrf.exempt
@@ -94,35 +488,267 @@ def new_student():
                 face_descriptor = face_descriptor.strip("'")
                 face_descriptor = json.loads(face_descriptor)
             
-            # Ensure it's a valid list of floats
-            face_descriptor = [float(x) for x in face_descriptor]
-            
-            # Store as a clean JSON string
-            face_encoding = json.dumps(face_descriptor)
+            # A student may be added before their face is captured; a descriptor
+            # that is sent must match the index dimension and be all finite numbers
+            if face_descriptor:
+                face_descriptor, error = student_import.check_descriptor(face_descriptor, get_face_index().dim)
+                if error:
+                    return jsonify({'success': False, 'error': error}), 400
+            else:
+                face_descriptor = np.empty(0, dtype=np.float32)
             
+            # Store in the compact binary format
             student = Student(
                 student_id=student_id,
                 name=data.get('name', 'Unknown'),
-                face_encoding=face_encoding
+                face_embedding=encode_descriptor(face_descriptor) if face_descriptor.size else None
             )
             
             db.session.add(student)
             db.session.commit()
             
+            # A student enrolled without a face has nothing to index or compare
+            if face_descriptor.size:
+                index_student(student.id, face_descriptor)
+                update_face_margin(student.id, face_descriptor)
+            
             return jsonify({'success': True, 'message': 'Student added successfully!'})
         except Exception as e:
-            print(f"Error saving student: {str(e)}")
+            logger.error(f"Error saving student: {str(e)}")
             return jsonify({'success': False, 'error': str(e)}), 400
         
     return render_template('admin/new_student.html')
 
-@app.route('/admin/sessions/new', methods=['GET', 'POST'])
-def new_session():
-    import logging
+def update_face_margin(student_pk, descriptor):
+    """Set a newly enrolled student's margin, and narrow their neighbour's if they are now closer"""
+    update_face_margins([student_pk], np.asarray(descriptor, dtype=np.float32).reshape(1, -1))
 
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
+def update_face_margins(student_pks, matrix):
+    """
+    update_face_margin for many newly indexed students with one search. Enrolled
+    students whose nearest face is new but not the other way round keep their
+    old margin until the next `flask face-quality` rescan.
+    """
+    neighbor_pks, distances = get_face_index().search_many(matrix, k=2)
+    updates = []
+    narrowed = {}
+    for student_pk, row_pks, row_distances in zip(student_pks, neighbor_pks, distances):
+        others = [(int(pk), float(distance)) for pk, distance in zip(row_pks, row_distances)
+                  if pk >= 0 and pk != student_pk]
+        if not others:
+            continue
+        neighbor_pk, distance = others[0]
+        updates.append({'id': student_pk, 'face_margin': distance, 'face_neighbor_id': neighbor_pk})
+        if neighbor_pk not in narrowed or narrowed[neighbor_pk][0] > distance:
+            narrowed[neighbor_pk] = (distance, student_pk)
+    if updates:
+        db.session.execute(db.update(Student), updates)
+    for neighbor_pk, (distance, student_pk) in narrowed.items():
+        Student.query.filter(Student.id == neighbor_pk, db.or_(Student.face_margin.is_(None), Student.face_margin > distance)).update(
+            {'face_margin': distance, 'face_neighbor_id': student_pk})
+    db.session.commit()
+
+def compute_face_margins(pair_distance=None):
+    """
+    Recompute every student's margin from the whole enrollment and store it.
+    Returns [(student_pk, other_student_pk, distance)] for faces closer than pair_distance.
+    """
+    matrix, ids = get_face_index().snapshot()
+    with span('face_quality'):
+        neighbours, margins, pairs = face_quality.scan(
+            matrix, pair_distance, max_block_elements=app.config['FACE_QUALITY_BLOCK_ELEMENTS'])
+    
+    updates = [{
+        'id': int(student_pk),
+        'face_margin': float(margin) if neighbour >= 0 else None,
+        'face_neighbor_id': int(ids[neighbour]) if neighbour >= 0 else None
+    } for student_pk, neighbour, margin in zip(ids, neighbours, margins)]
+    for offset in range(0, len(updates), 1000):
+        db.session.execute(db.update(Student), updates[offset:offset + 1000])
+        db.session.commit()
+    return [(int(ids[i]), int(ids[j]), distance) for i, j, distance in pairs]
+
+def reassign_face_neighbors(removed_pk):
+    """Recompute the margins of students whose nearest face was removed_pk; the caller commits"""
+    rows = db.session.query(Student.id, Student.face_embedding).filter(Student.face_neighbor_id == removed_pk).all()
+    if not rows:
+        return
+    matrix, valid = matrix_from_blobs([blob for _, blob in rows])
+    student_pks = [pk for (pk, _), ok in zip(rows, valid) if ok]
+    # Three results leave a neighbour after skipping the student and removed_pk
+    neighbor_pks, distances = get_face_index().search_many(matrix, k=3)
+    updates = [{'id': pk, 'face_margin': None, 'face_neighbor_id': None}
+               for (pk, _), ok in zip(rows, valid) if not ok]
+    for student_pk, row_pks, row_distances in zip(student_pks, neighbor_pks, distances):
+        others = [(int(pk), float(distance)) for pk, distance in zip(row_pks, row_distances)
+                  if pk >= 0 and pk not in (student_pk, removed_pk)]
+        updates.append({
+            'id': student_pk,
+            'face_margin': others[0][1] if others else None,
+            'face_neighbor_id': others[0][0] if others else None
+        })
+    db.session.execute(db.update(Student), updates)
+
+def ambiguous_face_pairs(max_distance):
+    """Stored pairs of enrolled students whose faces are closer than max_distance"""
+    Neighbor = db.aliased(Student)
+    rows = db.session.query(Student, Neighbor).join(Neighbor, Neighbor.id == Student.face_neighbor_id).filter(
+        Student.face_margin < max_distance).order_by(Student.face_margin)
+    pairs = {}
+    for student, neighbor in rows:
+        # Mutual nearest neighbours would otherwise be listed twice
+        key = (min(student.id, neighbor.id), max(student.id, neighbor.id))
+        pairs.setdefault(key, {
+            'distance': student.face_margin,
+            'students': [
+                {'id': student.id, 'student_id': student.student_id, 'name': student.name},
+                {'id': neighbor.id, 'student_id': neighbor.student_id, 'name': neighbor.name}
+            ]
+        })
+    return list(pairs.values())
+
+@app.route('/api/admin/face-quality')
+def api_face_quality():
+    """Enrolled faces so alike they may be twins or the same person enrolled twice"""
+    max_distance = request.args.get('max_distance', app.config['FACE_AMBIGUOUS_DISTANCE'], type=float)
+    return jsonify({'max_distance': max_distance, 'pairs': ambiguous_face_pairs(max_distance)})
+
+@app.cli.command('face-quality')
+@click.option('--max-distance', default=None, type=float,
+              help='Report faces closer than this (defaults to FACE_AMBIGUOUS_DISTANCE)')
+def face_quality_command(max_distance):
+    """Recompute face margins for every student and report ambiguous pairs"""
+    max_distance = max_distance or app.config['FACE_AMBIGUOUS_DISTANCE']
+    started = time.perf_counter()
+    pairs = compute_face_margins(pair_distance=max_distance)
+    print(f"Computed face margins for {len(get_face_index())} students in {time.perf_counter() - started:.1f}s")
+    
+    labels = dict(db.session.query(Student.id, Student.student_id).filter(
+        Student.id.in_(list({pk for pair in pairs for pk in pair[:2]})))) if pairs else {}
+    for first, second, distance in sorted(pairs, key=lambda pair: pair[2]):
+        print(f"{labels.get(first)} and {labels.get(second)}: distance {distance:.3f}")
+    print(f"{len(pairs)} pairs closer than {max_distance}")
+
+def existing_student_ids(student_ids):
+    """The subset of student_ids already enrolled"""
+    found = set()
+    for offset in range(0, len(student_ids), 500):
+        found.update(student_id for (student_id,) in db.session.query(Student.student_id).filter(
+            Student.student_id.in_(student_ids[offset:offset + 500])))
+    return found
+
+def nearest_enrolled_students(matrix):
+    """(student_id, distance) of the closest enrolled face to each row of matrix"""
+    student_pks, distances = get_face_index().search_many(matrix, k=1)
+    student_pks, distances = student_pks[:, 0], distances[:, 0]
+    # Only faces close enough to be reported need their student ID
+    close = sorted({int(pk) for pk in student_pks[distances < app.config['IMPORT_DUPLICATE_FACE_THRESHOLD']]})
+    labels = {}
+    for offset in range(0, len(close), 500):
+        labels.update(db.session.query(Student.id, Student.student_id).filter(
+            Student.id.in_(close[offset:offset + 500])))
+    return [(labels.get(int(pk)), float(distance)) for pk, distance in zip(student_pks, distances)]
+
+def import_students(rows, dry_run=False):
+    """
+    Validate parsed import rows as a whole and insert the valid ones in batched
+    transactions. Returns a report with one error entry per rejected row.
+    """
+    with span('student_import_validate'):
+        accepted, errors = student_import.validate(
+            rows, face_index.dim, existing_student_ids, nearest_enrolled_students,
+            app.config['IMPORT_DUPLICATE_FACE_THRESHOLD'])
+    
+    imported_pks = []
+    imported_vectors = []
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    for offset in range(0, 0 if dry_run else len(accepted), batch_size):
+        batch = accepted[offset:offset + batch_size]
+        try:
+            db.session.execute(Student.__table__.insert(), [{
+                'student_id': row['student_id'],
+                'name': row['name'] or 'Unknown',
+                'face_embedding': encode_descriptor(vector)
+            } for row, vector in batch])
+            db.session.commit()
+        except Exception as e:
+            # e.g. a student enrolled by someone else since validation; the other batches still go in
+            db.session.rollback()
+            errors.extend({'line': row['line'], 'student_id': row['student_id'], 'error': f"Not saved: {str(e)}"}
+                          for row, _ in batch)
+            continue
+        pks = dict(db.session.query(Student.student_id, Student.id).filter(
+            Student.student_id.in_([row['student_id'] for row, _ in batch])))
+        imported_pks.extend(pks[row['student_id']] for row, _ in batch)
+        imported_vectors.extend(vector for _, vector in batch)
+    
+    if imported_pks:
+        index_students(imported_pks, np.vstack(imported_vectors))
+        # Margins for the new faces, narrowing their neighbours'; `flask face-quality` does a full rescan
+        with span('student_import_margins'):
+            update_face_margins(imported_pks, np.vstack(imported_vectors))
+        logger.info(f"Imported {len(imported_pks)} students")
+    
+    errors.sort(key=lambda error: error['line'])
+    return {
+        'total': len(rows),
+        'valid': len(accepted),
+        'imported': len(imported_pks),
+        'failed': len(errors),
+        'dry_run': dry_run,
+        'errors': errors
+    }
+
+@app.route('/api/admin/students/import', methods=['POST'])
+@csrf.exempt
+def api_import_students():
+    """
+    Bulk enrollment from an uploaded CSV or NDJSON file ('file' form field) or a
+    raw request body. Columns: student_id, name, face_descriptor. Pass
+    dry_run=1 to only validate.
+    """
+    upload = request.files.get('file')
+    try:
+        if upload:
+            text = upload.read().decode('utf-8-sig')
+            fmt = student_import.detect_format(upload.filename, upload.mimetype)
+        else:
+            text = request.get_data().decode('utf-8-sig')
+            fmt = student_import.detect_format(content_type=request.content_type)
+    except UnicodeDecodeError:
+        return jsonify({'success': False, 'error': 'Import file must be UTF-8 text'}), 400
+    fmt = request.args.get('format', fmt)
+    if fmt not in student_import.FORMATS:
+        return jsonify({'success': False, 'error': 'format must be csv or ndjson'}), 400
+    
+    rows = student_import.read_rows(text, fmt)
+    if not rows:
+        return jsonify({'success': False, 'error': 'Import file has no rows'}), 400
+    if len(rows) > app.config['IMPORT_MAX_ROWS']:
+        return jsonify({'success': False, 'error': f"At most {app.config['IMPORT_MAX_ROWS']} rows per import"}), 400
+    
+    report = import_students(rows, dry_run=request.args.get('dry_run', '').lower() in ('1', 'true'))
+    return jsonify({'success': True, **report})
 
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(student_import.FORMATS), default=None,
+              help='File format (defaults to the file extension)')
+@click.option('--dry-run', is_flag=True, help='Validate without saving anything')
+def import_students_command(path, fmt, dry_run):
+    """Enroll students in bulk from a CSV or NDJSON file"""
+    with open(path, encoding='utf-8-sig') as f:
+        text = f.read()
+    report = import_students(student_import.read_rows(text, fmt or student_import.detect_format(path)), dry_run)
+    
+    for error in report['errors']:
+        print(f"line {error['line']} ({error['student_id'] or 'no ID'}): {error['error']}")
+    action = 'Validated' if dry_run else 'Imported'
+    count = report['valid'] if dry_run else report['imported']
+    print(f"{action} {count} of {report['total']} students, {report['failed']} rejected")
+
+@app.route('/admin/sessions/new', methods=['GET', 'POST'])
+def new_session():
     if request.method == 'POST':
         try:
             name = request.form['name']
@@ -130,88 +756,283 @@ def new_session():
             date = datetime.strptime(request.form['date'], '%Y-%m-%d')
             
             session = Session(name=name, date=date, classroom_id=classroom_id)
-            logging.info("Session created successfully.")
+            logger.info("Session created successfully.")
 
             db.session.add(session)
+            db.session.flush()
+            # Marks add to this row from the start, so the totals never need a recount
+            db.session.add(SessionStats(session_id=session.id, present=0, in_classroom=0))
             db.session.commit()
             
-            # Generate QR code
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(f"{request.host_url}attendance/{session.id}")
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            qr_code = base64.b64encode(buffered.getvalue()).decode()
-            
-            session.qr_code = qr_code
-            db.session.commit()
+            # Render the QR code in the background; it is served by session_qr
+            qr_codes.prefetch(session_attendance_url(session.id))
             
             flash('Session created successfully!', 'success')
-            logging.info("Redirecting to admin dashboard.")
             return redirect(url_for('admin_dashboard'))
         except Exception as e:
-            logging.error(f"Error creating session: {str(e)}")  # Log the error
+            logger.error(f"Error creating session: {str(e)}")
             flash('Error creating session. Please try again.', 'error')
             return redirect(url_for('admin_dashboard'))
 
     classrooms = Classroom.query.all()  # Or however you fetch your classrooms
     return render_template('admin/new_session.html', classrooms=classrooms)
 
+def session_attendance_url(session_id, base_url=None):
+    """The attendance page URL encoded in a session's QR code"""
+    base_url = base_url or app.config['QR_BASE_URL'] or request.host_url
+    return f"{base_url.rstrip('/')}/attendance/{session_id}"
+
+@app.route('/sessions/<int:session_id>/qr.<fmt>')
+def session_qr(session_id, fmt):
+    if fmt not in QR_FORMATS:
+        return jsonify({'error': 'Unsupported QR code format'}), 404
+    Session.query.get_or_404(session_id)
+    box_size = min(max(request.args.get('size', 10, type=int), 1), 40)
+    
+    content, key = qr_codes.get(session_attendance_url(session_id), fmt, box_size)
+    response = app.response_class(content, mimetype=QR_FORMATS[fmt])
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['QR_CACHE_MAX_AGE']
+    return response.make_conditional(request)
+
+@app.cli.command('pregenerate-qr')
+@click.option('--start', 'start_date', required=True, help='First session date (YYYY-MM-DD)')
+@click.option('--end', 'end_date', required=True, help='Last session date (YYYY-MM-DD)')
+@click.option('--base-url', default=None, help='Site URL encoded in the codes (defaults to QR_BASE_URL)')
+@click.option('--size', default=10, help='QR box size in pixels')
+def pregenerate_qr(start_date, end_date, base_url, size):
+    """Render QR codes for every session in a date range (e.g. a whole term)"""
+    base_url = base_url or app.config['QR_BASE_URL']
+    if not base_url:
+        raise click.UsageError('Pass --base-url or set QR_BASE_URL')
+    
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    session_ids = [session_id for (session_id,) in db.session.query(Session.id).filter(
+        Session.date >= start, Session.date <= end)]
+    
+    futures = []
+    for session_id in session_ids:
+        for fmt in QR_FORMATS:
+            futures.append(qr_codes.prefetch(session_attendance_url(session_id, base_url), fmt, size))
+    for future in futures:
+        if future is not None:
+            future.result()
+    print(f"Generated QR codes for {len(session_ids)} sessions")
+
 @app.route('/attendance/<int:session_id>')
 def attendance(session_id):
     session = Session.query.get_or_404(session_id)
     return render_template('attendance.html', session=session)
 
-def find_matching_student(face_descriptor, threshold=0.35):
-    students = Student.query.filter(Student.face_encoding.isnot(None)).all()
+def find_matching_students(face_descriptors, threshold=0.35, session=None):
+    """
+    Match several face descriptors in one matrix operation.
+    Returns a list with the matched Student (or None) for each descriptor.
+    """
+    roster_index = get_roster_index(session) if session is not None else None
+    index = roster_index if roster_index is not None else get_face_index()
+    with span('match'):
+        student_pks, distances = index.search_many(face_descriptors, k=1)
+        student_pks, distances = student_pks[:, 0], distances[:, 0]
+        queries = np.asarray(face_descriptors, dtype=np.float32).reshape(len(student_pks), -1)
+        searched_globally = np.full(len(student_pks), roster_index is None)
+        
+        missed = distances >= threshold
+        if roster_index is not None and missed.any() and app.config['ROSTER_FALLBACK_TO_GLOBAL']:
+            fallback_pks, fallback_distances = get_face_index().search_many(queries[missed], k=1)
+            student_pks[missed] = fallback_pks[:, 0]
+            distances[missed] = fallback_distances[:, 0]
+            searched_globally[missed] = True
+            missed = distances >= threshold
     
-    print(f"Total students with face encodings: {len(students)}")
+    matched_pks = {int(pk) for pk in student_pks[~missed]}
+    students = {s.id: s for s in Student.query.filter(Student.id.in_(matched_pks))} if matched_pks else {}
     
-    best_match = None
-    best_distance = float('inf')
+    ambiguous = reject_ambiguous_matches(queries, student_pks, distances, ~missed & searched_globally, students)
     
-    # Convert input face_descriptor to numpy array if it isn't already
-    face_descriptor = np.array(face_descriptor, dtype=np.float64)
+    # Per-face logging is debug only so it costs nothing on the hot path by default
+    log_matches = logger.isEnabledFor(logging.DEBUG)
+    matches = []
+    for student_pk, distance, is_missed, is_ambiguous in zip(student_pks, distances, missed, ambiguous):
+        student = None if is_missed or is_ambiguous else students.get(int(student_pk))
+        if student and log_matches:
+            logger.debug(f"Best match found: {student.name} with distance: {distance}")
+        matches.append(student)
     
-    for student in students:
-        try:
-            # Parse the stored face encoding from JSON string to numpy array
-            stored_descriptor = np.array(json.loads(student.face_encoding.strip("'")), dtype=np.float64)
-            
-            # Calculate distance
-            distance = norm(face_descriptor - stored_descriptor)
-            print(f"Distance for {student.name}: {distance}")
-            
-            if distance < threshold and distance < best_distance:
-                best_distance = distance
-                best_match = student
-                
-        except Exception as e:
-            print(f"Error processing student {student.name}: {str(e)}")
-            # Try to clean up the stored encoding and retry
-            try:
-                # Remove any extra quotes and spaces
-                cleaned_encoding = student.face_encoding.strip("'").replace("'", '"')
-                stored_descriptor = np.array(json.loads(cleaned_encoding), dtype=np.float64)
-                
-                distance = norm(face_descriptor - stored_descriptor)
-                print(f"Distance for {student.name} (after cleanup): {distance}")
-                
-                if distance < threshold and distance < best_distance:
-                    best_distance = distance
-                    best_match = student
-            except Exception as e2:
-                print(f"Failed second attempt for {student.name}: {str(e2)}")
-                continue
-    
-    if best_match:
-        print(f"\nBest match found: {best_match.name} with distance: {best_distance}")
+    matched = sum(1 for student in matches if student)
+    face_match_results.inc(matched, result='matched')
+    face_match_results.inc(int(ambiguous.sum()), result='ambiguous')
+    face_match_results.inc(len(matches) - matched - int(ambiguous.sum()), result='not_matched')
+    return matches
+
+def reject_ambiguous_matches(queries, student_pks, distances, checked, students):
+    """
+    Flag matches that do not beat the runner-up by FACE_MATCH_MIN_GAP.
+    Stored margins settle most of them without another search (see
+    face_quality.needs_runner_up); the rest get a two-nearest search. Margins
+    describe the whole enrollment, so only institution-wide matches are checked.
+    """
+    ambiguous = np.zeros(len(student_pks), dtype=bool)
+    if not checked.any():
+        return ambiguous
+    min_gap = app.config['FACE_MATCH_MIN_GAP']
+    
+    positions = np.flatnonzero(checked)
+    margins = np.array([getattr(students.get(int(student_pks[position])), 'face_margin', None)
+                        for position in positions], dtype=np.float32)
+    always, unsure = face_quality.needs_runner_up(distances[positions], margins, min_gap)
+    ambiguous[positions[always]] = True
+    if unsure.any():
+        unsure_positions = positions[unsure]
+        _, nearest_two = get_face_index().search_many(queries[unsure_positions], k=2)
+        runner_up = nearest_two[:, 1] if nearest_two.shape[1] > 1 else np.inf
+        ambiguous[unsure_positions] = runner_up - distances[unsure_positions] < min_gap
+    return ambiguous
+
+def count_attendance_result(result, in_classroom):
+    """Count one attendance outcome ('marked', 'already_marked' or 'not_recognized')"""
+    attendance_results.inc(result=result)
+    if result == 'marked' and not in_classroom:
+        out_of_classroom_marks.inc()
+
+def insert_ignoring_conflicts(table):
+    """INSERT statement for a table that silently skips rows violating a unique constraint"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
     else:
-        print("\nNo match found above threshold")
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).on_conflict_do_nothing()
+
+def attendance_insert():
+    """
+    INSERT statement for Attendance rows that silently skips any student
+    already marked for the session (the unique session/student index) and any
+    replayed client_key.
+    """
+    return insert_ignoring_conflicts(Attendance.__table__)
+
+def add_to_session_stats(marks):
+    """
+    Count newly inserted (row, in_classroom) marks in their sessions' running
+    totals. Runs in the caller's transaction, so totals commit with the marks.
+    Sessions without a totals row are left alone; they are recounted on read.
+    """
+    totals = {}
+    for row, in_classroom in marks:
+        present, inside, first, last = totals.get(row['session_id'], (0, 0, row['timestamp'], row['timestamp']))
+        totals[row['session_id']] = (present + 1, inside + bool(in_classroom),
+                                     min(first, row['timestamp']), max(last, row['timestamp']))
     
-    return best_match
+    for session_id, (present, inside, first, last) in totals.items():
+        db.session.execute(db.update(SessionStats).where(SessionStats.session_id == session_id).values(
+            present=SessionStats.present + present,
+            in_classroom=SessionStats.in_classroom + inside,
+            first_mark_at=db.case((SessionStats.first_mark_at.is_(None) | (SessionStats.first_mark_at > first), first),
+                                  else_=SessionStats.first_mark_at),
+            last_mark_at=db.case((SessionStats.last_mark_at.is_(None) | (SessionStats.last_mark_at < last), last),
+                                 else_=SessionStats.last_mark_at)
+        ))
+
+def flush_attendance(marks):
+    """Write a group of queued (row, in_classroom) marks and their session totals in one transaction"""
+    with app.app_context():
+        try:
+            inserted = [db.session.execute(attendance_insert(), row).rowcount == 1 for row, _ in marks]
+            add_to_session_stats([mark for mark, ok in zip(marks, inserted) if ok])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return inserted
+
+# Optional write-behind queue that groups concurrent marks into one commit
+attendance_writer = WriteBehindQueue(
+    flush_attendance,
+    max_batch=app.config['ATTENDANCE_WRITE_BATCH'],
+    max_latency=app.config['ATTENDANCE_WRITE_MAX_LATENCY'],
+    name='attendance-writer'
+) if app.config['ATTENDANCE_WRITE_BEHIND'] else None
+if attendance_writer is not None:
+    metrics.gauge('attendance_write_behind_pending', 'Attendance marks waiting to be written',
+                  attendance_writer.pending)
+
+def save_attendance(row, in_classroom):
+    """Insert one attendance mark and count it; returns False if the student was already marked"""
+    if attendance_writer is not None:
+        return attendance_writer.submit((row, in_classroom)).result()
+    inserted = db.session.execute(attendance_insert(), row).rowcount == 1
+    if inserted:
+        add_to_session_stats([(row, in_classroom)])
+    db.session.commit()
+    return inserted
+
+# Totals read by the live counters, shared by every poller and event stream in
+# this process for SESSION_STATS_MAX_AGE seconds: {session_id: (expires, totals)}
+session_stats_cache = {}
+
+def rebuild_session_stats(session):
+    """Recount a session's totals from its attendance rows and store them"""
+    records = db.session.query(Attendance.timestamp, Attendance.latitude, Attendance.longitude).join(
+        Student, Attendance.student_id == Student.id).filter(Attendance.session_id == session.id).all()
+    classroom = db.session.get(Classroom, session.classroom_id)
+    located = [(latitude, longitude) if latitude is not None and longitude is not None else (np.nan, np.nan)
+               for _, latitude, longitude in records]
+    with span('geofence'):
+        in_classroom = geofences.get(classroom).contains_many(located) if classroom and located else []
+    timestamps = [timestamp for timestamp, _, _ in records if timestamp is not None]
+    
+    values = {
+        'session_id': session.id,
+        'present': len(records),
+        'in_classroom': int(np.count_nonzero(in_classroom)),
+        'first_mark_at': min(timestamps, default=None),
+        'last_mark_at': max(timestamps, default=None)
+    }
+    # Another request may have rebuilt the same totals meanwhile
+    db.session.execute(insert_ignoring_conflicts(SessionStats.__table__), values)
+    db.session.commit()
+    return values
+
+def invalidate_session_stats(session_ids):
+    """Drop totals that no longer match the attendance rows; the caller commits"""
+    if not session_ids:
+        return
+    SessionStats.query.filter(SessionStats.session_id.in_(session_ids)).delete(synchronize_session=False)
+    for session_id in session_ids:
+        session_stats_cache.pop(session_id, None)
+
+def session_stats(session_id):
+    """Live totals for a session as a JSON-ready dict, or None if there is no such session"""
+    now = time.monotonic()
+    cached = session_stats_cache.get(session_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    # A Core select, so a long-lived event stream never sees identity-map copies
+    row = db.session.execute(
+        db.select(*SessionStats.__table__.c).where(SessionStats.session_id == session_id)).mappings().first()
+    if row is None:
+        # Sessions created before the totals existed, or whose totals were invalidated
+        session = db.session.get(Session, session_id)
+        if session is None:
+            return None
+        row = rebuild_session_stats(session)
+    
+    totals = {
+        'session_id': session_id,
+        'present': row['present'],
+        'in_classroom': row['in_classroom'],
+        'out_of_classroom': row['present'] - row['in_classroom'],
+        'first_mark_at': row['first_mark_at'].isoformat() if row['first_mark_at'] else None,
+        'last_mark_at': row['last_mark_at'].isoformat() if row['last_mark_at'] else None
+    }
+    session_stats_cache[session_id] = (now + app.config['SESSION_STATS_MAX_AGE'], totals)
+    return totals
+
+def find_matching_student(face_descriptor, threshold=0.35, session=None):
+    return find_matching_students([face_descriptor], threshold, session)[0]
 
 def point_inside_polygon(point, polygon_coords):
     """
@@ -237,57 +1058,388 @@ def point_inside_polygon(point, polygon_coords):
     
     return inside
 
+# Idempotency keys generated by clients so replayed submissions are recorded once
+CLIENT_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+def read_client_key(value):
+    """Validate an optional client_key; returns None when absent"""
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str) or not CLIENT_KEY_PATTERN.match(value):
+        raise ValueError('client_key must be 8-64 letters, digits, "-" or "_"')
+    return value
+
+def attendance_time(captured_at, now=None):
+    """
+    When a mark happened: the client's capture time (epoch milliseconds) for
+    submissions replayed from an offline queue, if it is plausible, otherwise now.
+    """
+    now = now or datetime.now()
+    if captured_at is None:
+        return now
+    try:
+        captured = datetime.fromtimestamp(float(captured_at) / 1000.0)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return now
+    age = (now - captured).total_seconds()
+    if -app.config['ATTENDANCE_MAX_CLOCK_SKEW'] <= age <= app.config['ATTENDANCE_MAX_OFFLINE_AGE']:
+        return min(captured, now)
+    return now
+
+def marks_by_client_key(client_keys):
+    """{client_key: Student} for marks already recorded under any of these keys"""
+    if not client_keys:
+        return {}
+    return {client_key: student for client_key, student in db.session.query(Attendance.client_key, Student).join(
+        Student, Attendance.student_id == Student.id).filter(Attendance.client_key.in_(client_keys))}
+
+def record_attendance(data):
+    """Match a submitted face and record attendance; returns the response body"""
+    face_descriptor = np.array(data['face_descriptor'])
+    session_id = data['session_id']
+    latitude = data['latitude']
+    longitude = data['longitude']
+    client_key = read_client_key(data.get('client_key'))
+    
+    # Get the session and its classroom
+    session = Session.query.get_or_404(session_id)
+    classroom = Classroom.query.get_or_404(session.classroom_id)
+    
+    # Check if student is in classroom
+    with span('geofence'):
+        is_in_classroom = geofences.get(classroom).contains(float(latitude), float(longitude))
+    
+    # A replayed submission returns the original outcome without matching again
+    replayed = marks_by_client_key([client_key]).get(client_key) if client_key else None
+    if replayed:
+        count_attendance_result('already_marked', is_in_classroom)
+        return {
+            'message': 'Attendance already marked',
+            'student_name': replayed.name,
+            'in_classroom': is_in_classroom
+        }
+    
+    matched_student = find_matching_student(face_descriptor, session=session)
+    if not matched_student:
+        count_attendance_result('not_recognized', is_in_classroom)
+        return {
+            'message': 'User not recognized',
+            'student_name': 'Unknown',
+            'in_classroom': is_in_classroom
+        }
+    
+    # Marking twice for the same session is a no-op rather than a duplicate row
+    inserted = save_attendance({
+        'student_id': matched_student.id,
+        'session_id': session.id,
+        'timestamp': attendance_time(data.get('captured_at')),
+        'latitude': latitude,
+        'longitude': longitude,
+        'client_key': client_key
+    }, is_in_classroom)
+    
+    if not inserted:
+        count_attendance_result('already_marked', is_in_classroom)
+        return {
+            'message': 'Attendance already marked',
+            'student_name': matched_student.name,
+            'in_classroom': is_in_classroom
+        }
+    
+    # Resolve the location name now rather than when the records are viewed
+    geocoder.enqueue(latitude, longitude)
+    count_attendance_result('marked', is_in_classroom)
+    
+    return {
+        'message': 'Attendance marked successfully',
+        'student_name': matched_student.name,
+        'in_classroom': is_in_classroom
+    }
+
 @app.route('/api/mark-attendance', methods=['POST'])
 @csrf.exempt
 def mark_attendance():
+    try:
+        return jsonify(record_attendance(request.json))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def process_queued_attendance(data):
+    # Runs on an ingestion worker thread
+    with app.app_context():
+        return record_attendance(data)
+
+attendance_pipeline = IngestionPipeline(
+    process_queued_attendance,
+    workers=app.config['INGEST_WORKERS'],
+    max_queue=app.config['INGEST_MAX_QUEUE'],
+    result_ttl=app.config['INGEST_RESULT_TTL'],
+    name='attendance-ingest'
+)
+metrics.gauge('attendance_ingest_queue_depth', 'Submissions waiting for an ingestion worker',
+              lambda: attendance_pipeline.metrics()['queue_depth'])
+
+@app.route('/api/attendance/submit', methods=['POST'])
+@csrf.exempt
+def submit_attendance():
+    """
+    Validate an attendance submission and queue it for matching.
+    Returns 202 with a ticket; the outcome is read from attendance_status.
+    Ticket state is held by the accepting process, so with several workers
+    clients need sticky routing; the attendance page uses /api/mark-attendance.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        descriptor = np.asarray(data['face_descriptor'], dtype=np.float32).reshape(-1)
+        if descriptor.shape[0] != face_index.dim:
+            raise ValueError(f"face_descriptor must have {face_index.dim} values")
+        payload = {
+            'face_descriptor': descriptor.tolist(),
+            'session_id': int(data['session_id']),
+            'latitude': float(data['latitude']),
+            'longitude': float(data['longitude']),
+            'client_key': read_client_key(data.get('client_key')),
+            'captured_at': data.get('captured_at')
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid submission: {str(e)}"}), 400
+    
+    if db.session.get(Session, payload['session_id']) is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    try:
+        ticket = attendance_pipeline.submit(payload)
+    except QueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        return response
+    
+    return jsonify({
+        'ticket': ticket,
+        'status_url': url_for('attendance_status', ticket=ticket),
+        'events_url': url_for('attendance_events', ticket=ticket)
+    }), 202
+
+@app.route('/api/attendance/status/<ticket>')
+def attendance_status(ticket):
+    state = attendance_pipeline.status(ticket)
+    if state is None:
+        return jsonify({'error': 'Unknown or expired ticket'}), 404
+    return jsonify({key: value for key, value in state.items() if key in ('status', 'result', 'error')})
+
+@app.route('/api/attendance/status/<ticket>/events')
+def attendance_events(ticket):
+    """Server-sent events stream that ends once the ticket is done or failed"""
+    if attendance_pipeline.status(ticket) is None:
+        return jsonify({'error': 'Unknown or expired ticket'}), 404
+    
+    def generate():
+        deadline = datetime.now().timestamp() + app.config['INGEST_EVENTS_TIMEOUT']
+        last_status = None
+        while True:
+            state = attendance_pipeline.wait(ticket, timeout=5)
+            if state is None:
+                return
+            if state['status'] != last_status:
+                last_status = state['status']
+                body = {key: value for key, value in state.items() if key in ('status', 'result', 'error')}
+                yield f"data: {json.dumps(body)}\n\n"
+            if state['status'] in ('done', 'failed') or datetime.now().timestamp() > deadline:
+                return
+            # Comment line keeps proxies from closing an idle stream
+            yield ": waiting\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/attendance/queue')
+def attendance_queue_stats():
+    return jsonify(attendance_pipeline.metrics())
+
+def record_attendance_batch(session, items):
+    """
+    Match and record many submissions for one session with a single index search,
+    geofence check and bulk insert. Returns (results, marked) with one result per
+    item, in order; items replaying a client_key that is already recorded return
+    the original outcome without being matched again.
+    """
+    classroom = Classroom.query.get_or_404(session.classroom_id)
+    geofence = geofences.get(classroom)
+    
+    results = [None] * len(items)
+    valid_positions = []
+    descriptors = []
+    seen_keys = set()
+    for position, item in enumerate(items):
+        try:
+            descriptor = np.asarray(item['face_descriptor'], dtype=np.float32).reshape(-1)
+            if descriptor.shape[0] != face_index.dim:
+                raise ValueError(f"face_descriptor must have {face_index.dim} values")
+            latitude = float(item['latitude'])
+            longitude = float(item['longitude'])
+            client_key = read_client_key(item.get('client_key'))
+            if client_key in seen_keys:
+                raise ValueError('client_key repeated within the batch')
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            results[position] = {'index': position, 'error': f"Invalid item: {str(e)}"}
+            continue
+        if client_key:
+            seen_keys.add(client_key)
+        valid_positions.append((position, latitude, longitude, client_key, item.get('captured_at')))
+        descriptors.append(descriptor)
+    
+    with span('geofence'):
+        in_classroom = geofence.contains_many([(latitude, longitude) for _, latitude, longitude, _, _ in valid_positions])
+    
+    # Replays of submissions that were already recorded skip matching entirely
+    replayed = marks_by_client_key(list(seen_keys))
+    pending = [n for n, (_, _, _, client_key, _) in enumerate(valid_positions) if client_key not in replayed]
+    matches = [None] * len(valid_positions)
+    if pending:
+        for n, student in zip(pending, find_matching_students(np.vstack([descriptors[n] for n in pending]), session=session)):
+            matches[n] = student
+    
+    # Students already marked for this session (earlier or in this batch) are not inserted again
+    matched_pks = [student.id for student in matches if student]
+    already_marked = {student_pk for (student_pk,) in db.session.query(Attendance.student_id).filter(
+        Attendance.session_id == session.id, Attendance.student_id.in_(matched_pks))} if matched_pks else set()
+    
+    now = datetime.now()
+    attendance_rows = []
+    row_marks = []
+    for (position, latitude, longitude, client_key, captured_at), student, is_in_classroom in zip(
+            valid_positions, matches, in_classroom):
+        is_in_classroom = bool(is_in_classroom)
+        result = {'index': position, 'in_classroom': is_in_classroom}
+        if client_key:
+            result['client_key'] = client_key
+        results[position] = result
+        
+        if client_key in replayed:
+            count_attendance_result('already_marked', is_in_classroom)
+            result.update(message='Attendance already marked', student_name=replayed[client_key].name)
+            continue
+        if not student:
+            count_attendance_result('not_recognized', is_in_classroom)
+            result.update(message='User not recognized', student_name='Unknown')
+            continue
+        if student.id in already_marked:
+            count_attendance_result('already_marked', is_in_classroom)
+            result.update(message='Attendance already marked', student_name=student.name)
+            continue
+        
+        already_marked.add(student.id)
+        attendance_rows.append({
+            'student_id': student.id,
+            'session_id': session.id,
+            'timestamp': attendance_time(captured_at, now),
+            'latitude': latitude,
+            'longitude': longitude,
+            'client_key': client_key
+        })
+        row_marks.append((result, student, is_in_classroom))
+    
+    # One bulk insert and one commit for the whole batch; the conflict clause
+    # covers marks that raced in from another request, and RETURNING tells
+    # which rows were actually inserted so only those are reported as marked
+    inserted = set()
+    if attendance_rows:
+        inserted = {student_pk for (student_pk,) in db.session.execute(
+            attendance_insert().returning(Attendance.__table__.c.student_id), attendance_rows)}
+        add_to_session_stats([(row, is_in_classroom) for row, (_, _, is_in_classroom) in zip(attendance_rows, row_marks)
+                              if row['student_id'] in inserted])
+    db.session.commit()
+    
+    for row, (result, student, is_in_classroom) in zip(attendance_rows, row_marks):
+        if student.id in inserted:
+            count_attendance_result('marked', is_in_classroom)
+            result.update(message='Attendance marked successfully', student_name=student.name)
+            geocoder.enqueue(row['latitude'], row['longitude'])
+        else:
+            count_attendance_result('already_marked', is_in_classroom)
+            result.update(message='Attendance already marked', student_name=student.name)
+    return results, len(inserted)
+
+@app.route('/api/mark-attendance/batch', methods=['POST'])
+@csrf.exempt
+def mark_attendance_batch():
+    """
+    Mark attendance for many faces captured by a kiosk in one request.
+    Body: {"session_id": ..., "items": [{"face_descriptor": [...], "latitude": ..., "longitude": ...}, ...]}
+    Items may carry a client_key (idempotency key) and captured_at (epoch milliseconds).
+    Returns one result per item, in the same order.
+    """
     try:
         data = request.json
-        face_descriptor = np.array(data['face_descriptor'])
         session_id = data['session_id']
-        latitude = data['latitude']
-        longitude = data['longitude']
+        items = data['items']
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        if len(items) > app.config['BATCH_ATTENDANCE_MAX_ITEMS']:
+            return jsonify({'error': f"At most {app.config['BATCH_ATTENDANCE_MAX_ITEMS']} items per batch"}), 400
         
-        # Get the session and its classroom
         session = Session.query.get_or_404(session_id)
-        classroom = Classroom.query.get_or_404(session.classroom_id)
-        
-        # Parse classroom coordinates
-        classroom_coords = json.loads(classroom.coordinates)
-        polygon_coords = []
-        for coord in classroom_coords:
-            lat, lon = map(float, coord.split(','))
-            polygon_coords.append((lat, lon))
-        
-        # Check if student is in classroom
-        is_in_classroom = point_inside_polygon((float(latitude), float(longitude)), polygon_coords)
-        
-        matched_student = find_matching_student(face_descriptor)
-        if not matched_student:
-            return jsonify({
-                'message': 'User not recognized',
-                'student_name': 'Unknown',
-                'in_classroom': is_in_classroom
-            }), 200
-        
-        attendance = Attendance(
-            student_id=matched_student.id,
-            session_id=session_id,
-            timestamp=datetime.now(),
-            latitude=latitude,
-            longitude=longitude
-        )
-        
-        db.session.add(attendance)
-        db.session.commit()
-        
+        results, marked = record_attendance_batch(session, items)
         return jsonify({
-            'message': 'Attendance marked successfully',
-            'student_name': matched_student.name,
-            'in_classroom': is_in_classroom
+            'session_id': session.id,
+            'marked': marked,
+            'results': results
         })
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/attendance/sync', methods=['POST'])
+@csrf.exempt
+def sync_attendance():
+    """
+    Replay submissions queued by offline clients, possibly for several sessions.
+    Body: {"items": [{"client_key": ..., "session_id": ..., "face_descriptor": [...],
+    "latitude": ..., "longitude": ..., "captured_at": ...}, ...]}
+    Every result carries its client_key; replaying a key never marks twice.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > app.config['BATCH_ATTENDANCE_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_ATTENDANCE_MAX_ITEMS']} items per batch"}), 400
+    
+    results = [None] * len(items)
+    by_session = {}
+    for position, item in enumerate(items):
+        try:
+            by_session.setdefault(int(item['session_id']), []).append(position)
+        except (KeyError, TypeError, ValueError) as e:
+            results[position] = {'index': position, 'client_key': item.get('client_key') if isinstance(item, dict) else None,
+                                 'error': f"Invalid item: {str(e)}"}
+    
+    sessions = {session.id: session for session in Session.query.filter(Session.id.in_(list(by_session)))}
+    marked = 0
+    for session_id, positions in by_session.items():
+        if session_id not in sessions:
+            for position in positions:
+                results[position] = {'index': position, 'client_key': items[position].get('client_key'),
+                                     'error': 'Session not found'}
+            continue
+        try:
+            session_results, session_marked = record_attendance_batch(sessions[session_id], [items[p] for p in positions])
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error syncing attendance for session {session_id}: {str(e)}")
+            for position in positions:
+                results[position] = {'index': position, 'client_key': items[position].get('client_key'),
+                                     'error': str(e), 'retry': True}
+            continue
+        marked += session_marked
+        for position, result in zip(positions, session_results):
+            result['index'] = position
+            result.setdefault('client_key', items[position].get('client_key'))
+            results[position] = result
+    
+    return jsonify({'marked': marked, 'results': results})
+
 @app.route('/attendance/success/<studentname>')
 def attendance_success(studentname):
     in_classroom = request.args.get('in_classroom', 'true').lower() == 'true'
@@ -298,7 +1450,69 @@ def attendance_success(studentname):
 
 @app.route('/static/models/<path:filename>')
 def serve_model(filename):
-    return send_from_directory('static/models', filename)
+    entry = model_assets.lookup(filename)
+    if entry is None:
+        # Source files under their original names are revalidated on every use
+        return send_from_directory('static/models', filename, max_age=0)
+    
+    path, encoding = entry['path'], None
+    for candidate, _ in MODEL_ENCODINGS:
+        if candidate in entry['encodings'] and request.accept_encodings[candidate]:
+            path, encoding = entry['encodings'][candidate], candidate
+            break
+    
+    # Each encoding is its own representation, so it gets its own strong ETag;
+    # send_file answers conditional and Range requests against it
+    response = send_file(
+        model_assets.file_path(path),
+        mimetype='application/json' if entry['path'].endswith('.json') else 'application/octet-stream',
+        etag=entry['sha256'] if encoding is None else f"{entry['sha256']}-{encoding}",
+        max_age=app.config['MODEL_ASSET_MAX_AGE'],
+        conditional=True
+    )
+    response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+OFFLINE_SCRIPTS = ('js/face-recognition.js', 'js/attendance-outbox.js')
+
+_offline_assets = {'signature': None, 'version': None}
+
+def offline_assets():
+    """URLs the service worker precaches and a version that changes with any of the files"""
+    # Built model files carry their content hash in their names
+    built = sorted(entry['path'] for entry in model_assets.manifest()['assets'].values())
+    urls = [url_for('serve_model', filename=name) for name in built]
+    signature = list(built)
+    files = [] if built else [
+        (os.path.join(app.static_folder, 'models', name), url_for('serve_model', filename=name))
+        for name in sorted(os.listdir(os.path.join(app.static_folder, 'models')))
+        if os.path.isfile(os.path.join(app.static_folder, 'models', name))
+    ]
+    files += [(os.path.join(app.static_folder, name), url_for('static', filename=name)) for name in OFFLINE_SCRIPTS]
+    
+    for path, url in files:
+        stat = os.stat(path)
+        signature.append((url, stat.st_size, stat.st_mtime_ns))
+        urls.append(url)
+    
+    signature = tuple(signature)
+    if signature != _offline_assets['signature']:
+        _offline_assets['version'] = hashlib.sha256(repr(signature).encode()).hexdigest()[:16]
+        _offline_assets['signature'] = signature
+    return urls, _offline_assets['version']
+
+@app.route('/service-worker.js')
+def service_worker():
+    urls, version = offline_assets()
+    body = render_template('service-worker.js', precache_urls=urls, cache_version=version,
+                           outbox_url=url_for('static', filename='js/attendance-outbox.js'))
+    response = Response(body, mimetype='application/javascript')
+    # Browsers must always revalidate the worker itself to pick up new asset versions
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/debug/students')
 def debug_students():
@@ -306,7 +1520,7 @@ def debug_students():
     return jsonify([{
         'id': s.id,
         'name': s.name,
-        'has_encoding': bool(s.face_encoding)
+        'has_encoding': s.has_face
     } for s in students])
 
 @app.route('/admin/students/delete/<int:student_id>', methods=['POST'])
@@ -314,23 +1528,19 @@ def debug_students():
 def delete_student(student_id):
     try:
         student = Student.query.get_or_404(student_id)
+        Enrollment.query.filter_by(student_id=student_id).delete()
+        # Their marks drop out of the attendance views, so those sessions are recounted
+        invalidate_session_stats([session_id for (session_id,) in db.session.query(
+            Attendance.session_id).filter_by(student_id=student_id)])
         db.session.delete(student)
+        # Students whose nearest face this was get a new neighbour in the same transaction
+        reassign_face_neighbors(student_id)
         db.session.commit()
+        unindex_student(student_id)
         return jsonify({'success': True, 'message': 'Student deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
-# Add this function to get location name from coordinates
-def get_location_name(latitude, longitude):
-    try:
-        geolocator = Nominatim(user_agent="attendance_system")
-        location = geolocator.reverse(f"{latitude}, {longitude}", language='en')
-        return location.address if location else "Location not found"
-    except GeocoderTimedOut:
-        return "Location lookup timed out"
-    except Exception:
-        return "Location lookup failed"
-
 # Add this route to view session attendance
 @app.route('/admin/attendance/<int:session_id>')
 def session_attendance(session_id):
@@ -345,14 +1555,34 @@ def session_attendance(session_id):
         Attendance.session_id == session_id
     ).all()
     
+    # Check every record against the classroom geofence in one vectorized call
+    classroom = db.session.get(Classroom, session.classroom_id)
+    located = [(attendance.latitude, attendance.longitude) if attendance.latitude is not None
+               and attendance.longitude is not None else (np.nan, np.nan)
+               for attendance, _ in attendance_records]
+    with span('geofence'):
+        in_classroom = geofences.get(classroom).contains_many(located) if classroom and located else []
+    
+    # Resolve all location names at once; cached cells need no network lookup and
+    # anything still unresolved after the timeout keeps resolving in the background
+    with span('geocode_lookup'):
+        location_names = geocoder.lookup_many(
+            [(attendance.latitude, attendance.longitude) for attendance, _ in attendance_records],
+            timeout=app.config['GEOCODER_RENDER_TIMEOUT']
+        )
+    
     # Process attendance records to include location names
     attendance_data = []
-    for attendance, student in attendance_records:
-        location_name = get_location_name(attendance.latitude, attendance.longitude)
+    for (attendance, student), is_in_classroom in zip(attendance_records, in_classroom):
+        location_name = PENDING_LOCATION
+        if attendance.latitude is not None and attendance.longitude is not None:
+            location_name = location_names.get(
+                geocoder.key(attendance.latitude, attendance.longitude), PENDING_LOCATION)
         attendance_data.append({
             'student': student,
             'attendance': attendance,
-            'location': location_name
+            'location': location_name,
+            'in_classroom': bool(is_in_classroom)
         })
     
     return render_template(
@@ -361,14 +1591,162 @@ def session_attendance(session_id):
         attendance_data=attendance_data
     )
 
+@app.route('/api/admin/sessions/<int:session_id>/stats')
+def session_stats_api(session_id):
+    """Live totals for polling; unchanged totals answer 304 to If-None-Match"""
+    totals = session_stats(session_id)
+    if totals is None:
+        return jsonify({'error': 'Session not found'}), 404
+    response = jsonify(totals)
+    response.set_etag(hashlib.sha1(json.dumps(totals, sort_keys=True).encode()).hexdigest())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/admin/sessions/<int:session_id>/stats/events')
+def session_stats_events(session_id):
+    """Server-sent events stream of a session's totals, sent whenever they change (opt-in)"""
+    if not app.config['SESSION_STATS_EVENTS']:
+        return jsonify({'error': 'Event streams are disabled; poll the stats endpoint'}), 404
+    if session_stats(session_id) is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    def generate():
+        deadline = time.monotonic() + app.config['SESSION_STATS_EVENTS_TIMEOUT']
+        last_totals = None
+        while True:
+            totals = session_stats(session_id)
+            # Give the connection back to the pool while the stream waits
+            db.session.remove()
+            if totals is None:
+                return
+            if totals != last_totals:
+                last_totals = totals
+                yield f"data: {json.dumps(totals)}\n\n"
+            else:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": waiting\n\n"
+            if time.monotonic() > deadline:
+                # EventSource reconnects by itself
+                return
+            time.sleep(app.config['SESSION_STATS_MAX_AGE'])
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.cli.command('rebuild-session-stats')
+def rebuild_session_stats_command():
+    """Recount every session's live attendance totals from the attendance rows"""
+    SessionStats.query.delete()
+    db.session.commit()
+    session_stats_cache.clear()
+    sessions = Session.query.all()
+    for session in sessions:
+        rebuild_session_stats(session)
+    print(f"Rebuilt attendance totals for {len(sessions)} sessions")
+
+def attendance_export_query(session_id=None, classroom_id=None, student_id=None, date_from=None, date_to=None):
+    """Attendance joined with its student and session, streamed from the database in chunks"""
+    query = db.session.query(
+        Attendance.id, Attendance.timestamp, Attendance.latitude, Attendance.longitude,
+        Session.id.label('session_id'), Session.name.label('session_name'),
+        Session.date.label('session_date'), Session.classroom_id,
+        Student.student_id, Student.name.label('student_name')
+    ).join(Student, Attendance.student_id == Student.id).join(Session, Attendance.session_id == Session.id)
+    if session_id:
+        query = query.filter(Attendance.session_id == session_id)
+    if classroom_id:
+        query = query.filter(Session.classroom_id == classroom_id)
+    if student_id:
+        query = query.filter(Attendance.student_id == student_id)
+    if date_from:
+        query = query.filter(Session.date >= date_from)
+    if date_to:
+        query = query.filter(Session.date <= date_to)
+    return query.order_by(Attendance.id).yield_per(app.config['EXPORT_CHUNK_SIZE'])
+
+def attendance_export_chunks(rows):
+    """
+    Turn streamed export rows into record dicts, one chunk at a time. Geofence
+    checks and cached location names are resolved per chunk; locations that
+    were never geocoded are left blank rather than looked up.
+    """
+    classrooms = {classroom.id: classroom for classroom in Classroom.query.all()}
+    for chunk in attendance_export.chunked(rows, app.config['EXPORT_CHUNK_SIZE']):
+        located = np.array([(row.latitude, row.longitude) if row.latitude is not None
+                            and row.longitude is not None else (np.nan, np.nan) for row in chunk],
+                           dtype=np.float64)
+        classroom_ids = np.array([row.classroom_id for row in chunk])
+        in_classroom = np.zeros(len(chunk), dtype=bool)
+        with span('geofence'):
+            for classroom_id in set(classroom_ids.tolist()):
+                if classroom_id in classrooms:
+                    mask = classroom_ids == classroom_id
+                    in_classroom[mask] = geofences.get(classrooms[classroom_id]).contains_many(located[mask])
+        
+        keys = [geocoder.key(row.latitude, row.longitude) if row.latitude is not None
+                and row.longitude is not None else None for row in chunk]
+        location_names = geocoder.store.get_many({key for key in keys if key})
+        
+        yield [{
+            'attendance_id': row.id,
+            'timestamp': row.timestamp,
+            'session_id': row.session_id,
+            'session_name': row.session_name,
+            'session_date': row.session_date,
+            'classroom_id': row.classroom_id,
+            'classroom_name': classrooms[row.classroom_id].name if row.classroom_id in classrooms else None,
+            'student_id': row.student_id,
+            'student_name': row.student_name,
+            'latitude': row.latitude,
+            'longitude': row.longitude,
+            'in_classroom': bool(is_in_classroom),
+            'location': location_names.get(key, '') if key else ''
+        } for row, is_in_classroom, key in zip(chunk, in_classroom, keys)]
+
+@app.route('/admin/export/attendance.<fmt>')
+@app.route('/admin/sessions/<int:session_id>/attendance.<fmt>')
+@app.route('/admin/classrooms/<int:classroom_id>/attendance.<fmt>')
+@app.route('/admin/students/<int:student_id>/attendance.<fmt>')
+def export_attendance(fmt, session_id=None, classroom_id=None, student_id=None):
+    """
+    Stream attendance as CSV or NDJSON. The generic endpoint takes session_id,
+    classroom_id, student_id, date_from and date_to (YYYY-MM-DD) query parameters.
+    """
+    if fmt not in attendance_export.FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 404
+    session_id = session_id or request.args.get('session_id', type=int)
+    classroom_id = classroom_id or request.args.get('classroom_id', type=int)
+    student_id = student_id or request.args.get('student_id', type=int)
+    try:
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        # Inclusive of the whole last day
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if date_to else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+    
+    rows = attendance_export_query(session_id, classroom_id, student_id, date_from, date_to)
+    body = attendance_export.stream(attendance_export_chunks(rows), fmt)
+    
+    scope = '-'.join(f"{name}-{value}" for name, value in (
+        ('session', session_id), ('classroom', classroom_id), ('student', student_id)) if value)
+    filename = f"attendance{'-' + scope if scope else ''}.{fmt}"
+    return Response(stream_with_context(body), mimetype=attendance_export.FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/admin/sessions/delete/<int:session_id>', methods=['POST'])
 @csrf.exempt
 def delete_session(session_id):
     try:
         session = Session.query.get_or_404(session_id)
         
-        # Delete all attendance records for this session
+        # Delete all attendance records, totals and roster entries for this session
         Attendance.query.filter_by(session_id=session_id).delete()
+        invalidate_session_stats([session_id])
+        Enrollment.query.filter_by(session_id=session_id).delete()
         
         # Delete the session
         db.session.delete(session)
@@ -378,36 +1756,55 @@ def delete_session(session_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+def read_classroom_coordinates(form):
+    """
+    Build the Classroom.coordinates JSON from a submitted classroom form.
+    Corners are sent as corner1..cornerN (at least three). A classroom spanning
+    several rooms can instead send 'rooms', a JSON list of corner lists.
+    Returns None if any corner is missing.
+    """
+    if form.get('rooms'):
+        rooms = json.loads(form['rooms'])
+        if not rooms or any(len(room) < 3 or not all(room) for room in rooms):
+            return None
+        parse_rooms(rooms)  # Raises ValueError on malformed corners
+        return json.dumps(rooms)
+    
+    corner_keys = sorted((key for key in form if re.fullmatch(r'corner\d+', key)), key=lambda key: int(key[6:]))
+    corners = [form[key] for key in corner_keys]
+    if len(corners) < 3 or not all(corners):
+        return None
+    parse_rooms(corners)
+    return json.dumps(corners)
+
 @app.route('/admin/classrooms/new', methods=['GET', 'POST'])
 @csrf.exempt
 def new_classroom():
     if request.method == 'POST':
         name = request.form['name']
         try:
-            corner1 = request.form['corner1']
-            corner2 = request.form['corner2']
-            corner3 = request.form['corner3']
-            corner4 = request.form['corner4']
+            coordinates = read_classroom_coordinates(request.form)
             
             # Log the received coordinates for debugging
-            print(f"Received coordinates: corner1={corner1}, corner2={corner2}, corner3={corner3}, corner4={corner4}")
+            logger.debug(f"Received coordinates: {coordinates}")
             
             # Validate that all corners are provided
-            if not all([corner1, corner2, corner3, corner4]):
-                return jsonify({'success': False, 'error': 'All corners must be provided.'}), 400
+            if not coordinates:
+                return jsonify({'success': False, 'error': 'All corners must be provided (at least three).'}), 400
             
             # Create a new classroom
             classroom = Classroom(
                 name=name,
-                coordinates=json.dumps([corner1, corner2, corner3, corner4])  # Store corners as JSON
+                coordinates=coordinates  # Store corners as JSON
             )
             
             db.session.add(classroom)
             db.session.commit()
+            geofences.invalidate(classroom.id)
             
             return jsonify({'success': True, 'message': 'Classroom added successfully!'})
         except Exception as e:
-            print(f"Error saving classroom: {str(e)}")
+            logger.error(f"Error saving classroom: {str(e)}")
             return jsonify({'success': False, 'error': str(e)}), 400
     
     # Render the form for adding a new classroom
@@ -426,27 +1823,31 @@ def edit_classroom(classroom_id):
     if request.method == 'POST':
         try:
             name = request.form['name']
-            corner1 = request.form['corner1']
-            corner2 = request.form['corner2']
-            corner3 = request.form['corner3']
-            corner4 = request.form['corner4']
+            coordinates = read_classroom_coordinates(request.form)
             
             # Validate that all corners are provided
-            if not all([corner1, corner2, corner3, corner4]):
-                return jsonify({'success': False, 'error': 'All corners must be provided.'}), 400
+            if not coordinates:
+                return jsonify({'success': False, 'error': 'All corners must be provided (at least three).'}), 400
             
-            # Update classroom
+            # Update classroom; a new outline changes who counts as in the classroom
+            if coordinates != classroom.coordinates:
+                invalidate_session_stats([session_id for (session_id,) in db.session.query(
+                    Session.id).filter_by(classroom_id=classroom_id)])
             classroom.name = name
-            classroom.coordinates = json.dumps([corner1, corner2, corner3, corner4])
+            classroom.coordinates = coordinates
             
             db.session.commit()
+            geofences.invalidate(classroom_id)
             return jsonify({'success': True, 'message': 'Classroom updated successfully!'})
         except Exception as e:
-            print(f"Error updating classroom: {str(e)}")
+            logger.error(f"Error updating classroom: {str(e)}")
             return jsonify({'success': False, 'error': str(e)}), 400
     
     coordinates = json.loads(classroom.coordinates)
-    return render_template('admin/edit_classroom.html', classroom=classroom, coordinates=coordinates)
+    # Classrooms made of several rooms are edited as JSON
+    rooms = coordinates if coordinates and isinstance(coordinates[0], list) else None
+    return render_template('admin/edit_classroom.html', classroom=classroom,
+                           coordinates=coordinates if rooms is None else [], rooms=rooms)
 
 @app.route('/admin/classrooms/delete/<int:classroom_id>', methods=['POST'])
 @csrf.exempt
@@ -462,15 +1863,84 @@ def delete_classroom(classroom_id):
                 'error': 'Cannot delete classroom as it is being used in one or more sessions.'
             }), 400
         
+        Enrollment.query.filter_by(classroom_id=classroom_id).delete()
         db.session.delete(classroom)
         db.session.commit()
+        geofences.invalidate(classroom_id)
         return jsonify({'success': True, 'message': 'Classroom deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+def update_roster(classroom_id=None, session_id=None):
+    """
+    Shared handler for classroom and session roster endpoints.
+    GET returns the enrolled student IDs; POST takes
+    {"student_ids": [...], "mode": "replace" | "add" | "remove"}.
+    """
+    roster_query = Enrollment.query.filter_by(classroom_id=classroom_id, session_id=session_id)
+    
+    if request.method == 'POST':
+        try:
+            data = request.get_json(force=True)
+            mode = data.get('mode', 'replace')
+            if mode not in ('replace', 'add', 'remove'):
+                return jsonify({'success': False, 'error': 'Mode must be replace, add or remove'}), 400
+            
+            requested_ids = [str(x) for x in data.get('student_ids', [])]
+            students = Student.query.filter(Student.student_id.in_(requested_ids)).all() if requested_ids else []
+            found = {student.student_id: student.id for student in students}
+            unknown = [x for x in requested_ids if x not in found]
+            
+            if mode == 'replace':
+                roster_query.delete()
+            if mode == 'remove':
+                if found:
+                    roster_query.filter(Enrollment.student_id.in_(found.values())).delete()
+            else:
+                existing = {pk for (pk,) in roster_query.with_entities(Enrollment.student_id)}
+                db.session.add_all([
+                    Enrollment(student_id=pk, classroom_id=classroom_id, session_id=session_id)
+                    for pk in set(found.values()) - existing
+                ])
+            
+            bump_roster_version(classroom_id, session_id)
+            db.session.commit()
+            
+            return jsonify({
+                'success': True,
+                'message': 'Roster updated successfully!',
+                'enrolled': roster_query.count(),
+                'unknown_student_ids': unknown
+            })
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error updating roster: {str(e)}")
+            return jsonify({'success': False, 'error': str(e)}), 400
+    
+    rows = db.session.query(Student.student_id).join(
+        Enrollment, Enrollment.student_id == Student.id
+    ).filter(
+        Enrollment.classroom_id == classroom_id, Enrollment.session_id == session_id
+    ).order_by(Student.student_id)
+    return jsonify({'success': True, 'student_ids': [student_id for (student_id,) in rows]})
+
+@app.route('/admin/classrooms/<int:classroom_id>/roster', methods=['GET', 'POST'])
+@csrf.exempt
+def classroom_roster(classroom_id):
+    Classroom.query.get_or_404(classroom_id)
+    return update_roster(classroom_id=classroom_id)
+
+@app.route('/admin/sessions/<int:session_id>/roster', methods=['GET', 'POST'])
+@csrf.exempt
+def session_roster(session_id):
+    Session.query.get_or_404(session_id)
+    return update_roster(session_id=session_id)
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        upgrade_database(db.engine)
+        load_face_index()
     
-    print("WARNING: For camera access on all devices, this app must be served over HTTPS in production.")
+    logger.warning("For camera access on all devices, this app must be served over HTTPS in production.")
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,63 @@
+"""
+Streaming attendance exports.
+
+Rows are read from the database in chunks (Query.yield_per) and encoded as
+CSV or NDJSON one chunk at a time, so a term-wide report is sent with the
+same memory footprint as a single session.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from itertools import islice
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+COLUMNS = (
+    'attendance_id', 'timestamp', 'session_id', 'session_name', 'session_date',
+    'classroom_id', 'classroom_name', 'student_id', 'student_name',
+    'latitude', 'longitude', 'in_classroom', 'location',
+)
+
+
+def chunked(rows, size):
+    """Yield lists of up to size items from any iterable"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(records, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows([_plain(record[column]) for column in COLUMNS] for record in records)
+    return buffer.getvalue()
+
+
+def encode_ndjson(records):
+    return ''.join(json.dumps({column: _plain(record[column]) for column in COLUMNS}) + '\n' for record in records)
+
+
+def stream(record_chunks, fmt):
+    """Encode chunks of record dicts; a CSV header is sent even for an empty report"""
+    if fmt == 'csv':
+        yield encode_csv([], header=True)
+        for records in record_chunks:
+            yield encode_csv(records)
+    else:
+        for records in record_chunks:
+            yield encode_ndjson(records)
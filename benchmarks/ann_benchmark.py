@@ -0,0 +1,107 @@
+"""
+Recall-vs-latency benchmark for the approximate (IVF) face index backend.
+
+Generates synthetic face-api.js style descriptors, runs the same queries
+through the exact brute-force backend and the IVF backend at several nprobe
+settings, and reports recall@1, match agreement under the threshold and
+per-query latency.
+
+Usage:
+    python benchmarks/ann_benchmark.py --students 50000 --queries 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_index import DESCRIPTOR_DIM, BruteForceBackend, FaceIndex, IVFBackend
+
+
+def synthetic_descriptors(n, rng, n_clusters=64):
+    """Clustered descriptors with roughly the scale of face-api.js output"""
+    centers = rng.normal(0.0, 0.12, size=(n_clusters, DESCRIPTOR_DIM))
+    labels = rng.integers(n_clusters, size=n)
+    return (centers[labels] + rng.normal(0.0, 0.06, size=(n, DESCRIPTOR_DIM))).astype(np.float32)
+
+
+def time_queries(index, queries):
+    start = time.perf_counter()
+    pks, distances = index.search_many(queries, k=1)
+    elapsed = time.perf_counter() - start
+    return pks[:, 0], distances[:, 0], elapsed * 1000.0 / len(queries)
+
+
+def run(students, n_queries, nlist, nprobes, threshold, seed):
+    rng = np.random.default_rng(seed)
+    descriptors = synthetic_descriptors(students, rng)
+    ids = np.arange(1, students + 1)
+
+    # Queries are enrolled faces seen again with camera noise
+    targets = rng.integers(students, size=n_queries)
+    queries = descriptors[targets] + rng.normal(0.0, 0.01, size=(n_queries, DESCRIPTOR_DIM)).astype(np.float32)
+
+    exact = FaceIndex(backend=BruteForceBackend())
+    exact.load_matrix(descriptors, ids)
+    exact_pks, exact_distances, exact_ms = time_queries(exact, queries)
+    exact_matched = exact_distances < threshold
+
+    results = {
+        'students': students,
+        'queries': n_queries,
+        'threshold': threshold,
+        'exact_ms_per_query': exact_ms,
+        'ivf': []
+    }
+    print(f"exact: {exact_ms:.3f} ms/query")
+
+    backend = IVFBackend(nlist=nlist, min_train_size=min(students, 4096))
+    start = time.perf_counter()
+    ivf = FaceIndex(backend=backend)
+    ivf.load_matrix(descriptors, ids)
+    build_s = time.perf_counter() - start
+    results['ivf_build_s'] = build_s
+    print(f"ivf build (nlist={nlist}): {build_s:.2f} s")
+
+    for nprobe in nprobes:
+        backend.nprobe = nprobe
+        pks, distances, ms = time_queries(ivf, queries)
+        recall = float(np.mean(pks == exact_pks))
+        matched = distances < threshold
+        agreement = float(np.mean((matched == exact_matched) & (~matched | (pks == exact_pks))))
+        results['ivf'].append({
+            'nprobe': nprobe,
+            'ms_per_query': ms,
+            'recall_at_1': recall,
+            'threshold_agreement': agreement,
+            'speedup': exact_ms / ms if ms else None
+        })
+        print(f"nprobe={nprobe:4d}: {ms:.3f} ms/query, recall@1={recall:.4f}, "
+              f"threshold agreement={agreement:.4f}, speedup={exact_ms / ms:.1f}x")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nlist', type=int, default=256)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--threshold', type=float, default=0.35)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = run(args.students, args.queries, args.nlist, args.nprobe, args.threshold, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+Latency and throughput benchmark for the attendance hot paths.
+
+Builds a throwaway SQLite database (via DATABASE_URL) filled with synthetic
+students, a classroom and sessions, then measures at increasing scales:
+
+  match      find_matching_student against N enrolled students
+  geofence   point_inside_polygon vs the vectorized Geofence on N points
+  mark       /api/mark-attendance end to end through the Flask test client,
+             M marks sent from --concurrency threads
+  render     the session attendance page holding M marks, stub geocoder
+  qr         new_session plus rendering of the session QR code
+
+Results are written as JSON together with the git commit so runs can be
+compared across commits.
+
+Usage:
+    python benchmarks/hot_paths.py --output bench.json
+    python benchmarks/hot_paths.py --students 100 1000 --marks 1 10 100 --only match mark
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCHMARKS = ('match', 'geofence', 'mark', 'render', 'qr')
+
+# A classroom of roughly 40 x 40 metres
+CLASSROOM_CORNERS = ["5.6500,-0.1870", "5.6500,-0.1866", "5.6504,-0.1866", "5.6504,-0.1870"]
+
+
+def summarize(latencies_s, elapsed_s=None):
+    """Latency percentiles in milliseconds, plus throughput when elapsed_s is given"""
+    latencies = np.asarray(latencies_s, dtype=np.float64) * 1000.0
+    summary = {
+        'count': int(len(latencies)),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+    if elapsed_s:
+        summary['throughput_per_s'] = len(latencies) / elapsed_s
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Fixture:
+    """The application bound to a temporary database, grown on demand"""
+
+    def __init__(self, workdir, seed):
+        # Must be set before app is imported
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+
+        import app as app_module
+        from geocoding import StubProvider
+        from migrations import upgrade
+        from qr_cache import QRCodeCache
+
+        self.app_module = app_module
+        self.app = app_module.app
+        self.db = app_module.db
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['TESTING'] = True
+        # Keep the benchmark offline and away from the real QR cache
+        app_module.geocoder.provider = StubProvider()
+        app_module.qr_codes = QRCodeCache(os.path.join(workdir, 'qr_cache'))
+
+        self.rng = np.random.default_rng(seed)
+        self.descriptors = np.empty((0, 128), dtype=np.float32)
+        self.student_pks = np.empty(0, dtype=np.int64)
+
+        with self.app.app_context():
+            self.db.create_all()
+            upgrade(self.db.engine)
+            classroom = app_module.Classroom(name='Benchmark hall', coordinates=json.dumps(CLASSROOM_CORNERS))
+            self.db.session.add(classroom)
+            self.db.session.commit()
+            self.classroom_id = classroom.id
+
+    def grow_students(self, total):
+        """Enroll synthetic students until total are enrolled"""
+        from face_index import encode_descriptor
+
+        missing = total - len(self.student_pks)
+        if missing <= 0:
+            return
+        start = len(self.student_pks)
+        descriptors = self.rng.normal(0.0, 0.1, size=(missing, 128)).astype(np.float32)
+        rows = [{
+            'student_id': f"{start + i:010d}",
+            'name': f"Student {start + i}",
+            'face_embedding': encode_descriptor(descriptor),
+        } for i, descriptor in enumerate(descriptors)]
+
+        Student = self.app_module.Student
+        with self.app.app_context():
+            for offset in range(0, len(rows), 5000):
+                self.db.session.execute(Student.__table__.insert(), rows[offset:offset + 5000])
+            self.db.session.commit()
+            pks = [pk for (pk,) in self.db.session.query(Student.id).filter(
+                Student.student_id >= f"{start:010d}").order_by(Student.student_id)]
+            self.app_module.load_face_index()
+
+        self.descriptors = np.vstack([self.descriptors, descriptors])
+        self.student_pks = np.concatenate([self.student_pks, np.asarray(pks, dtype=np.int64)])
+
+    def new_session(self, name):
+        from datetime import datetime
+
+        with self.app.app_context():
+            session = self.app_module.Session(name=name, date=datetime.now(), classroom_id=self.classroom_id)
+            self.db.session.add(session)
+            self.db.session.commit()
+            return session.id
+
+    def camera_views(self, count):
+        """Noisy re-captures of distinct enrolled faces; returns (descriptors, student positions)"""
+        positions = self.rng.choice(len(self.student_pks), size=count, replace=False)
+        noise = self.rng.normal(0.0, 0.01, size=(count, 128)).astype(np.float32)
+        return self.descriptors[positions] + noise, positions
+
+
+def bench_match(fixture, scales, queries):
+    results = []
+    for students in scales:
+        fixture.grow_students(students)
+        descriptors, positions = fixture.camera_views(min(queries, students))
+        latencies = []
+        correct = 0
+        with fixture.app.app_context():
+            for descriptor, position in zip(descriptors, positions):
+                start = time.perf_counter()
+                student = fixture.app_module.find_matching_student(descriptor)
+                latencies.append(time.perf_counter() - start)
+                correct += student is not None and student.id == fixture.student_pks[position]
+        result = {'students': students, 'accuracy': correct / len(positions), **summarize(latencies)}
+        results.append(result)
+        print(f"match     students={students:>7}: p50={result['p50_ms']:.3f} ms p95={result['p95_ms']:.3f} ms")
+    return results
+
+
+def bench_geofence(fixture, scales):
+    from geofence import Geofence, parse_rooms
+
+    polygon = parse_rooms(CLASSROOM_CORNERS)[0]
+    geofence = Geofence.from_coordinates(CLASSROOM_CORNERS)
+    results = []
+    for points in scales:
+        lats = fixture.rng.uniform(5.6495, 5.6509, size=points)
+        lons = fixture.rng.uniform(-0.1875, -0.1861, size=points)
+
+        start = time.perf_counter()
+        scalar = [fixture.app_module.point_inside_polygon((lat, lon), polygon) for lat, lon in zip(lats, lons)]
+        scalar_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectorized = geofence.contains_many(np.column_stack([lats, lons]))
+        vectorized_s = time.perf_counter() - start
+
+        result = {
+            'points': points,
+            'point_inside_polygon_ms': scalar_s * 1000.0,
+            'geofence_contains_many_ms': vectorized_s * 1000.0,
+            'agree': bool(np.array_equal(np.asarray(scalar), vectorized)),
+        }
+        results.append(result)
+        print(f"geofence  points={points:>7}: loop={result['point_inside_polygon_ms']:.3f} ms "
+              f"vectorized={result['geofence_contains_many_ms']:.3f} ms")
+    return results
+
+
+def bench_mark(fixture, scales, concurrency):
+    """Returns (results, {marks: session id}) so the render benchmark can reuse the sessions"""
+    results = []
+    sessions = {}
+    for marks in scales:
+        if marks > len(fixture.student_pks):
+            print(f"mark      marks={marks:>7}: skipped, only {len(fixture.student_pks)} students enrolled")
+            continue
+        session_id = fixture.new_session(f"Mark benchmark {marks}")
+        descriptors, _ = fixture.camera_views(marks)
+        payloads = [{
+            'face_descriptor': descriptor.tolist(),
+            'session_id': session_id,
+            'latitude': 5.6502,
+            'longitude': -0.1868,
+        } for descriptor in descriptors]
+
+        def post(payload):
+            client = fixture.app.test_client()
+            start = time.perf_counter()
+            response = client.post('/api/mark-attendance', json=payload)
+            body = response.get_json() or {}
+            ok = response.status_code == 200 and body.get('message') == 'Attendance marked successfully'
+            return time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(post, payloads))
+        elapsed = time.perf_counter() - start
+
+        errors = sum(1 for _, ok in outcomes if not ok)
+        result = {
+            'marks': marks,
+            'concurrency': concurrency,
+            'students': int(len(fixture.student_pks)),
+            'error_rate': errors / marks,
+            **summarize([latency for latency, _ in outcomes], elapsed),
+        }
+        results.append(result)
+        sessions[marks] = session_id
+        print(f"mark      marks={marks:>7}: p50={result['p50_ms']:.2f} ms p99={result['p99_ms']:.2f} ms "
+              f"{result['throughput_per_s']:.0f}/s errors={errors}")
+    return results, sessions
+
+
+def bench_render(fixture, sessions, repeats):
+    results = []
+    client = fixture.app.test_client()
+    for marks, session_id in sorted(sessions.items()):
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            response = client.get(f'/admin/attendance/{session_id}')
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+        result = {'marks': marks, **summarize(latencies)}
+        results.append(result)
+        print(f"render    marks={marks:>7}: p50={result['p50_ms']:.2f} ms")
+    return results
+
+
+def bench_qr(fixture, scales):
+    from datetime import date
+
+    client = fixture.app.test_client()
+    results = []
+    for sessions in scales:
+        create = []
+        fetch = []
+        for i in range(sessions):
+            start = time.perf_counter()
+            client.post('/admin/sessions/new', data={
+                'name': f"QR benchmark {sessions}-{i}",
+                'classroom_id': fixture.classroom_id,
+                'date': date.today().isoformat(),
+            })
+            create.append(time.perf_counter() - start)
+
+        with fixture.app.app_context():
+            newest = [session_id for (session_id,) in fixture.db.session.query(
+                fixture.app_module.Session.id).order_by(fixture.app_module.Session.id.desc()).limit(sessions)]
+        for session_id in newest:
+            start = time.perf_counter()
+            response = client.get(f'/sessions/{session_id}/qr.png')
+            fetch.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+
+        result = {
+            'sessions': sessions,
+            'new_session': summarize(create),
+            'qr_fetch': summarize(fetch),
+        }
+        results.append(result)
+        print(f"qr        sessions={sessions:>6}: new_session p50={result['new_session']['p50_ms']:.2f} ms "
+              f"qr fetch p50={result['qr_fetch']['p50_ms']:.2f} ms")
+    return results
+
+
+def run(args):
+    selected = args.only or BENCHMARKS
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks': {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='attendance-bench-') as workdir:
+        fixture = Fixture(workdir, args.seed)
+        if 'match' in selected:
+            results['benchmarks']['match'] = bench_match(fixture, args.students, args.queries)
+        if 'geofence' in selected:
+            results['benchmarks']['geofence'] = bench_geofence(fixture, args.points)
+
+        sessions = {}
+        if 'mark' in selected or 'render' in selected:
+            # Marks need one distinct enrolled student each
+            fixture.grow_students(max(max(args.marks), min(args.students)))
+            marks, sessions = bench_mark(fixture, args.marks, args.concurrency)
+            if 'mark' in selected:
+                results['benchmarks']['mark'] = marks
+        if 'render' in selected:
+            results['benchmarks']['render'] = bench_render(fixture, sessions, args.repeats)
+        if 'qr' in selected:
+            results['benchmarks']['qr'] = bench_qr(fixture, args.sessions)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200, help='Match queries per student scale')
+    parser.add_argument('--points', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--marks', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads sending marks')
+    parser.add_argument('--repeats', type=int, default=5, help='Renders per attendance page')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='Run only these benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
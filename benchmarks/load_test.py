@@ -0,0 +1,372 @@
+"""
+Load test for /api/mark-attendance.
+
+Enrolls synthetic students in a throwaway database (the hot_paths Fixture,
+with a delayed stub geocoder standing in for Nominatim), then sends realistic
+submissions at each --concurrency level:
+
+  - descriptors are noisy re-captures of enrolled faces, plus a share of
+    faces nobody enrolled and resubmissions of faces already marked
+  - GPS points fall inside the classroom polygon or in the streets around it
+
+Requests go through the Flask test client (--target wsgi) or over HTTP to a
+local threaded server (--target http). Every level reports p50/p95/p99
+latency, throughput, error rate and misidentified students; the highest level
+whose p95 stays under --slo-ms is reported as the sustainable concurrency.
+
+With --profile DIR the level with the worst p95 is sent again with every
+request profiled, and the slowest --profile-top requests are written as:
+
+  slowest.prof    cProfile stats (python -m pstats, snakeviz)
+  slowest.folded  sampled stacks, one "frame;frame;... count" line each
+                  (flamegraph.pl, speedscope, inferno)
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1 4 16 64 --requests 500
+    python benchmarks/load_test.py --target http --concurrency 32 --profile profiles/
+"""
+import argparse
+import cProfile
+import http.client
+import json
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from hot_paths import CLASSROOM_CORNERS, ROOT, Fixture, git_commit, summarize
+
+OUTCOMES = {
+    'Attendance marked successfully': 'marked',
+    'Attendance already marked': 'already_marked',
+    'User not recognized': 'not_recognized',
+}
+
+_corners = np.array([[float(value) for value in corner.split(',')] for corner in CLASSROOM_CORNERS])
+CLASSROOM_MIN = _corners.min(axis=0)
+CLASSROOM_MAX = _corners.max(axis=0)
+# Points outside the classroom land within about 100 metres of it
+SURROUNDINGS = 0.001
+
+
+def gps_point(rng, inside):
+    """A (latitude, longitude) inside the classroom, or around it"""
+    if inside:
+        span = CLASSROOM_MAX - CLASSROOM_MIN
+        return tuple(CLASSROOM_MIN + span * rng.uniform(0.05, 0.95, size=2))
+    while True:
+        point = rng.uniform(CLASSROOM_MIN - SURROUNDINGS, CLASSROOM_MAX + SURROUNDINGS)
+        if ((point < CLASSROOM_MIN) | (point > CLASSROOM_MAX)).any():
+            return tuple(point)
+
+
+def make_submissions(fixture, session_id, count, args):
+    """(payload, expected student name or None) pairs for one session"""
+    rng = fixture.rng
+    order = rng.permutation(len(fixture.student_pks))
+    kinds = rng.choice(['enrolled', 'unknown', 'repeat'], size=count,
+                       p=[1.0 - args.unknown - args.repeat, args.unknown, args.repeat])
+    marked = []
+    submissions = []
+    for kind in kinds:
+        if kind == 'unknown':
+            descriptor = rng.normal(0.0, 0.1, size=128)
+            expected = None
+        else:
+            if kind == 'repeat' and marked:
+                position = marked[rng.integers(len(marked))]
+            else:
+                # Fresh students in turn; past the enrolled count they repeat
+                position = order[len(marked) % len(order)]
+                marked.append(position)
+            descriptor = fixture.descriptors[position] + rng.normal(0.0, args.noise, size=128)
+            expected = f"Student {position}"
+        latitude, longitude = gps_point(rng, rng.random() >= args.outside)
+        submissions.append(({
+            'face_descriptor': descriptor.tolist(),
+            'session_id': session_id,
+            'latitude': latitude,
+            'longitude': longitude,
+        }, expected))
+    return submissions
+
+
+class WSGIClient:
+    """Posts through a Flask test client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def post(self, path, payload):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.post(path, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    """Posts over a keep-alive HTTP connection per thread"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.local = threading.local()
+
+    def post(self, path, payload):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        connection = self.local.connection
+        try:
+            connection.request('POST', path, body=json.dumps(payload),
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+
+def start_local_server(app):
+    from werkzeug.serving import make_server
+
+    # One log line per request would dominate the run
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True).start()
+    return server
+
+
+def send_all(client, submissions, concurrency):
+    """Send every submission from concurrency threads; returns (outcomes, elapsed seconds)"""
+    def send(submission):
+        payload, expected = submission
+        start = time.perf_counter()
+        try:
+            status, body = client.post('/api/mark-attendance', payload)
+        except Exception:
+            return time.perf_counter() - start, 'error', False
+        latency = time.perf_counter() - start
+        body = body or {}
+        if status != 200 or 'error' in body:
+            return latency, 'error', False
+        outcome = OUTCOMES.get(body.get('message'), 'error')
+        misidentified = body.get('student_name') not in ('Unknown', expected)
+        return latency, outcome, misidentified
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, submissions))
+    return outcomes, time.perf_counter() - start
+
+
+def run_level(fixture, client, concurrency, args):
+    session_id = fixture.new_session(f"Load test concurrency {concurrency}")
+    outcomes, elapsed = send_all(client, make_submissions(fixture, session_id, args.requests, args), concurrency)
+    counts = Counter(outcome for _, outcome, _ in outcomes)
+    result = {
+        'concurrency': concurrency,
+        'error_rate': counts['error'] / len(outcomes),
+        'outcomes': dict(counts),
+        'misidentified': sum(1 for _, _, misidentified in outcomes if misidentified),
+        **summarize([latency for latency, _, _ in outcomes], elapsed),
+    }
+    print(f"concurrency={concurrency:>4}: p50={result['p50_ms']:.1f} ms p95={result['p95_ms']:.1f} ms "
+          f"p99={result['p99_ms']:.1f} ms {result['throughput_per_s']:.0f}/s "
+          f"errors={result['error_rate']:.1%} misidentified={result['misidentified']}")
+    return result
+
+
+def _frame_name(code):
+    """'app.py:record_attendance' for this repo, 'flask/app.py:Flask.wsgi_app' for libraries"""
+    filename = code.co_filename
+    if filename.startswith(ROOT + os.sep):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        filename = os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+    return f"{filename}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class RequestProfiler:
+    """
+    WSGI middleware that runs each request under its own cProfile profiler
+    while a sampler thread records the request thread's stack every interval
+    seconds. Python 3.12+ allows one active cProfile at a time; requests that
+    overlap an active one get stack samples only.
+    """
+
+    def __init__(self, wsgi_app, interval):
+        self.wsgi_app = wsgi_app
+        self.interval = interval
+        self.requests = []  # (seconds, cProfile.Profile or None, Counter of folded stacks)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='load-test-sampler', daemon=True)
+        self._sampler.start()
+
+    def __call__(self, environ, start_response):
+        stacks = Counter()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None
+        self._active[threading.get_ident()] = stacks
+        start = time.perf_counter()
+        try:
+            # The whole body is produced inside the profile
+            return list(self.wsgi_app(environ, start_response))
+        finally:
+            if profile is not None:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            del self._active[threading.get_ident()]
+            with self._lock:
+                self.requests.append((elapsed, profile, stacks))
+
+    def _sample(self):
+        own_code = RequestProfiler.__call__.__code__
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, stacks in list(self._active.items()):
+                frame = frames.get(thread_id)
+                names = []
+                # Stacks start at this middleware; harness frames above it are dropped
+                while frame is not None and frame.f_code is not own_code:
+                    names.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                if names:
+                    stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def write(self, directory, top):
+        """Write the slowest requests' profile and folded stacks; returns their latencies in ms"""
+        slowest = sorted(self.requests, key=lambda request: request[0], reverse=True)[:top]
+        os.makedirs(directory, exist_ok=True)
+
+        profiles = [profile for _, profile, _ in slowest if profile is not None]
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(directory, 'slowest.prof'))
+            stats.sort_stats('cumulative').print_stats(25)
+
+        folded = Counter()
+        for _, _, stacks in slowest:
+            folded.update(stacks)
+        with open(os.path.join(directory, 'slowest.folded'), 'w') as f:
+            for stack, count in sorted(folded.items()):
+                f.write(f"{stack} {count}\n")
+        return [elapsed * 1000.0 for elapsed, _, _ in slowest], len(profiles)
+
+
+def profile_level(fixture, client, concurrency, args):
+    profiler = RequestProfiler(fixture.app.wsgi_app, args.sample_interval / 1000.0)
+    fixture.app.wsgi_app = profiler
+    try:
+        session_id = fixture.new_session(f"Load test profile {concurrency}")
+        send_all(client, make_submissions(fixture, session_id, args.requests, args), concurrency)
+    finally:
+        fixture.app.wsgi_app = profiler.wsgi_app
+        profiler.stop()
+    slowest_ms, profiled = profiler.write(args.profile, args.profile_top)
+    print(f"Profiled the {len(slowest_ms)} slowest requests at concurrency {concurrency} "
+          f"({slowest_ms[-1]:.1f}-{slowest_ms[0]:.1f} ms) into {args.profile}")
+    return {
+        'concurrency': concurrency,
+        'slowest_ms': slowest_ms,
+        'cprofiled_requests': profiled,
+        'files': ['slowest.prof', 'slowest.folded'],
+    }
+
+
+def run(args):
+    results = {
+        'commit': git_commit(),
+        'target': args.target,
+        'students': args.students,
+        'requests_per_level': args.requests,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'levels': [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix='attendance-load-') as workdir:
+        fixture = Fixture(workdir, args.seed)
+        from geocoding import StubProvider
+        fixture.app_module.geocoder.provider = StubProvider(delay=args.geocoder_delay_ms / 1000.0)
+        fixture.grow_students(args.students)
+
+        server = None
+        if args.target == 'http':
+            server = start_local_server(fixture.app)
+            client = HTTPClient('127.0.0.1', server.server_port)
+        else:
+            client = WSGIClient(fixture.app)
+
+        try:
+            # Warm caches, connections and the face index before measuring
+            warmup = fixture.new_session('Load test warm-up')
+            send_all(client, make_submissions(fixture, warmup, min(50, args.requests), args), 4)
+
+            for concurrency in args.concurrency:
+                results['levels'].append(run_level(fixture, client, concurrency, args))
+
+            sustainable = [level['concurrency'] for level in results['levels']
+                           if level['p95_ms'] <= args.slo_ms and level['error_rate'] <= args.max_error_rate]
+            results['sustainable_concurrency'] = max(sustainable, default=None)
+            print(f"Highest concurrency with p95 <= {args.slo_ms:g} ms and errors <= {args.max_error_rate:.0%}: "
+                  f"{results['sustainable_concurrency']}")
+
+            if args.profile:
+                worst = max(results['levels'], key=lambda level: level['p95_ms'])
+                results['profile'] = profile_level(fixture, client, worst['concurrency'], args)
+        finally:
+            if server is not None:
+                server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=('wsgi', 'http'), default='wsgi')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=500, help='Submissions per concurrency level')
+    parser.add_argument('--students', type=int, default=2000, help='Enrolled students')
+    parser.add_argument('--noise', type=float, default=0.01, help='Descriptor noise between enrolment and capture')
+    parser.add_argument('--unknown', type=float, default=0.05, help='Share of faces nobody enrolled')
+    parser.add_argument('--repeat', type=float, default=0.05, help='Share of resubmitted faces')
+    parser.add_argument('--outside', type=float, default=0.2, help='Share of GPS points outside the classroom')
+    parser.add_argument('--geocoder-delay-ms', type=float, default=100.0, help='Stub geocoder response time')
+    parser.add_argument('--slo-ms', type=float, default=500.0, help='p95 latency a level must stay under')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--profile', metavar='DIR', help='Profile the slowest level into this directory')
+    parser.add_argument('--profile-top', type=int, default=20, help='Slowest requests kept in the profile')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='Stack sampling interval in ms')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,128 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 # Secret key for session management
 SECRET_KEY = 'your-secret-key-here'
 
-# SQLite database URI
+# SQLite database URI (set the DATABASE_URL environment variable to use e.g. PostgreSQL instead)
 SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'instance', 'attendance.db')
 
+# Connection pool
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT = 30
+
+# SQLite tuning: WAL lets readers run alongside the single writer, NORMAL sync is
+# safe in WAL mode, and writers wait for the lock instead of failing immediately
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# Marks replayed from an offline client keep the client's capture time when it is at
+# most this many seconds old (and no more than the allowed clock skew in the future)
+ATTENDANCE_MAX_OFFLINE_AGE = 12 * 3600
+ATTENDANCE_MAX_CLOCK_SKEW = 300
+
+# Write-behind queue: group attendance marks from concurrent requests into one
+# transaction, waiting at most ATTENDANCE_WRITE_MAX_LATENCY seconds to fill a batch
+ATTENDANCE_WRITE_BEHIND = False
+ATTENDANCE_WRITE_BATCH = 50
+ATTENDANCE_WRITE_MAX_LATENCY = 0.02
+
+# Bulk student import: students inserted per transaction, largest accepted file, and the
+# face distance under which an imported face counts as an already enrolled student
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_ROWS = 20000
+IMPORT_DUPLICATE_FACE_THRESHOLD = 0.35
+
+# Rows fetched and encoded per chunk by the streaming attendance exports
+EXPORT_CHUNK_SIZE = 1000
+
+# Log level for the application loggers; per-face match details are logged at DEBUG
+LOG_LEVEL = 'INFO'
+
+# Record hot-path counters and latency histograms, served at /metrics in Prometheus format
+METRICS_ENABLED = True
+
 # Disable SQLAlchemy track modifications (improves performance)
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Face matching index: 'brute' (exact linear scan) or 'ivf' (approximate, for large enrollments)
+FACE_INDEX_BACKEND = 'brute'
+FACE_INDEX_IVF_NLIST = 256
+FACE_INDEX_IVF_NPROBE = 8
+# Below this many enrolled students the IVF backend falls back to an exact scan
+FACE_INDEX_IVF_MIN_TRAIN_SIZE = 4096
+# Trained IVF centroids are kept next to the database
+FACE_INDEX_IVF_PATH = os.path.join(basedir, 'instance', 'face_index_ivf.npz')
+
+# 'local' keeps a private descriptor matrix in every worker process. 'shared' publishes it
+# as memory-mapped files so all workers (e.g. gunicorn -w 8) map a single copy and a new
+# worker starts without reading every face from the database.
+FACE_INDEX_MODE = 'local'
+FACE_INDEX_SHARED_DIR = os.path.join(basedir, 'instance', 'face_index')
+
+# A match to a student whose face is close to another enrolled face (twins, double
+# enrollment) must be at least this much closer than the runner-up, or it is rejected.
+# Needs margins from 'flask face-quality'; students without one are matched as before.
+FACE_MATCH_MIN_GAP = 0.05
+# Enrolled faces closer together than this are reported as ambiguous pairs
+FACE_AMBIGUOUS_DISTANCE = 0.4
+# Distances held in memory at once by the face-quality scan (float32 values)
+FACE_QUALITY_BLOCK_ELEMENTS = 1 << 24
+
+# When a session has a roster, only enrolled students are matched. Set this to also
+# search every enrolled face when nobody on the roster matches.
+ROSTER_FALLBACK_TO_GLOBAL = False
+# Roster indexes kept in memory per worker; each holds a copy of its students' descriptors
+ROSTER_INDEX_CACHE_SIZE = 64
+
+# Largest number of faces accepted by /api/mark-attendance/batch in one request
+BATCH_ATTENDANCE_MAX_ITEMS = 500
+
+# Reverse geocoding of attendance locations: 'nominatim', or 'stub' for offline testing
+GEOCODER_PROVIDER = 'nominatim'
+GEOCODER_USER_AGENT = 'attendance_system'
+# Geohash length used as the cache key (8 characters is roughly 38m x 19m)
+GEOCODER_PRECISION = 8
+GEOCODER_MAX_WORKERS = 4
+# Minimum seconds between provider requests (Nominatim's usage policy is 1 per second)
+GEOCODER_MIN_INTERVAL = 1.0
+# How long the attendance page waits for uncached names before showing them as pending
+GEOCODER_RENDER_TIMEOUT = 2.0
+
+# Session QR codes are rendered once and cached in memory and under this directory
+QR_CACHE_DIR = os.path.join(basedir, 'instance', 'qr_cache')
+QR_CACHE_MAX_ENTRIES = 256
+QR_RENDER_WORKERS = 2
+# Seconds browsers may cache a QR image
+QR_CACHE_MAX_AGE = 86400
+# Site URL encoded in QR codes (e.g. 'https://attendance.example.edu'); defaults to the request host
+QR_BASE_URL = None
+
+# Fingerprinted, precompressed face-api.js models built by download_models.py.
+# Their names change with their content, so browsers may keep them for a year
+MODEL_ASSET_DIR = os.path.join(basedir, 'static', 'models', 'dist')
+MODEL_ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Live session counters: seconds one read of a session's totals is shared by every
+# poller and event stream in the process. The attendance page polls; set
+# SESSION_STATS_EVENTS = True to push totals over server-sent events instead, which
+# holds a server thread per open page for up to SESSION_STATS_EVENTS_TIMEOUT seconds
+SESSION_STATS_MAX_AGE = 2
+SESSION_STATS_EVENTS = False
+SESSION_STATS_EVENTS_TIMEOUT = 30
+
+# Rows per page on the admin dashboard and its JSON API
+DASHBOARD_PAGE_SIZE = 25
+DASHBOARD_MAX_PAGE_SIZE = 100
+
+# Asynchronous attendance ingestion (/api/attendance/submit; tickets are per process,
+# so use it with one worker or sticky routing): worker threads, started on first use,
+# queued submissions accepted before answering 503, and how long results are kept
+INGEST_WORKERS = 4
+INGEST_MAX_QUEUE = 1000
+INGEST_RESULT_TTL = 300
+# Longest a status event stream stays open, in seconds
+INGEST_EVENTS_TIMEOUT = 60
+
 # Upload folder for student face images
 UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
 
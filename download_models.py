@@ -1,6 +1,21 @@
+import json
 import os
+import sys
 import urllib.request
 
+import model_assets
+from config import MODEL_ASSET_DIR
+
+def download(url, file_path):
+    print(f"Downloading {os.path.basename(file_path)}...")
+    try:
+        urllib.request.urlretrieve(url, file_path)
+        print(f"Successfully downloaded {os.path.basename(file_path)}")
+        return True
+    except Exception as e:
+        print(f"Error downloading {os.path.basename(file_path)}: {e}")
+        return False
+
 def download_models():
     # Create models directory if it doesn't exist
     models_dir = os.path.join('static', 'models')
@@ -9,29 +24,50 @@ def download_models():
     # Base URL for the model files
     base_url = "https://raw.githubusercontent.com/justadudewhohacks/face-api.js/master/weights"
 
-    # List of model files to download
-    model_files = [
-        'tiny_face_detector_model-weights_manifest.json',
-        'tiny_face_detector_model-shard1',
-        'face_landmark_68_model-weights_manifest.json',
-        'face_landmark_68_model-shard1',
-        'face_recognition_model-weights_manifest.json',
-        'face_recognition_model-shard1'
+    # Models used by static/js/face-recognition.js; each manifest lists its shards
+    models = [
+        'tiny_face_detector_model',
+        'face_landmark_68_model',
+        'face_recognition_model'
     ]
 
-    # Download each file
-    for file in model_files:
-        file_path = os.path.join(models_dir, file)
-        if not os.path.exists(file_path):
-            print(f"Downloading {file}...")
-            url = f"{base_url}/{file}"
-            try:
-                urllib.request.urlretrieve(url, file_path)
-                print(f"Successfully downloaded {file}")
-            except Exception as e:
-                print(f"Error downloading {file}: {e}")
+    for model in models:
+        manifest_file = model + model_assets.MANIFEST_SUFFIX
+        manifest_path = os.path.join(models_dir, manifest_file)
+        if not os.path.exists(manifest_path):
+            if not download(f"{base_url}/{manifest_file}", manifest_path):
+                continue
         else:
-            print(f"File {file} already exists")
+            print(f"File {manifest_file} already exists")
+
+        with open(manifest_path) as f:
+            shards = model_assets.shard_paths(json.load(f))
+        problems = model_assets.verify_model(models_dir, model)
+        for shard in shards:
+            file_path = os.path.join(models_dir, shard)
+            # Shards of an incomplete model are fetched again: a truncated file has the right name
+            if not os.path.exists(file_path) or problems:
+                download(f"{base_url}/{shard}", file_path)
+            else:
+                print(f"File {shard} already exists")
+
+    # Check every model against its manifest, then fingerprint and compress the complete ones
+    failed = False
+    for model in models:
+        problems = model_assets.verify_model(models_dir, model)
+        for problem in problems:
+            print(f"{model}: {problem}")
+        failed = failed or bool(problems)
+
+    manifest, skipped = model_assets.build(models_dir, MODEL_ASSET_DIR)
+    for model, path in manifest['models'].items():
+        print(f"Built {model} -> {path}")
+    for model in skipped:
+        if model not in models:
+            print(f"Skipped {model} (incomplete, not used by the app)")
+    if model_assets.brotli is None:
+        print("Install the brotli package to also serve brotli-compressed models")
+    return not failed
 
 if __name__ == "__main__":
-    download_models() 
\ No newline at end of file
+    sys.exit(0 if download_models() else 1)
@@ -0,0 +1,403 @@
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# face-api.js produces 128-dimensional face descriptors
+DESCRIPTOR_DIM = 128
+
+# Binary descriptor format stored in Student.face_embedding:
+# magic "FD", format version, dtype code (1 = little-endian float32), dimension,
+# followed by dimension float32 values (512 bytes for a 128-d descriptor)
+EMBEDDING_MAGIC = b'FD'
+EMBEDDING_VERSION = 1
+EMBEDDING_FLOAT32 = 1
+EMBEDDING_HEADER = struct.Struct('<2sBBI')
+
+
+def embedding_dtype(dim=DESCRIPTOR_DIM):
+    """NumPy record layout of one stored embedding, header included"""
+    return np.dtype([
+        ('magic', 'S2'),
+        ('version', 'u1'),
+        ('dtype', 'u1'),
+        ('dim', '<u4'),
+        ('vector', '<f4', (dim,))
+    ])
+
+
+def encode_descriptor(descriptor):
+    """Pack a descriptor into the versioned binary format"""
+    vector = np.asarray(descriptor, dtype='<f4').reshape(-1)
+    header = EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_VERSION, EMBEDDING_FLOAT32, vector.shape[0])
+    return header + vector.tobytes()
+
+
+def decode_descriptor(blob):
+    """Unpack a binary descriptor without copying the float data"""
+    magic, version, dtype_code, dim = EMBEDDING_HEADER.unpack_from(blob)
+    if magic != EMBEDDING_MAGIC or version != EMBEDDING_VERSION or dtype_code != EMBEDDING_FLOAT32:
+        raise ValueError('Unsupported face embedding format')
+    if len(blob) != EMBEDDING_HEADER.size + 4 * dim:
+        raise ValueError('Truncated face embedding')
+    return np.frombuffer(blob, dtype='<f4', count=dim, offset=EMBEDDING_HEADER.size)
+
+
+def matrix_from_blobs(blobs, dim=DESCRIPTOR_DIM):
+    """
+    Build an (n, dim) descriptor matrix from stored embeddings with a single
+    np.frombuffer over the concatenated rows instead of decoding row by row.
+    Returns (matrix, valid) where valid flags the blobs that were well formed.
+    """
+    record = embedding_dtype(dim)
+    valid = np.array([blob is not None and len(blob) == record.itemsize for blob in blobs], dtype=bool)
+    records = np.frombuffer(b''.join(blob for blob, ok in zip(blobs, valid) if ok), dtype=record)
+
+    well_formed = ((records['magic'] == EMBEDDING_MAGIC) & (records['version'] == EMBEDDING_VERSION)
+                   & (records['dtype'] == EMBEDDING_FLOAT32) & (records['dim'] == dim))
+    valid[valid] = well_formed
+    return records['vector'][well_formed], valid
+
+
+def parse_face_encoding(face_encoding):
+    """
+    Parse a stored face encoding (JSON text) into a float32 vector.
+    Older rows were sometimes saved wrapped in single quotes, so those are
+    cleaned up before giving up on the row.
+    """
+    try:
+        values = json.loads(face_encoding.strip("'"))
+    except ValueError:
+        values = json.loads(face_encoding.strip("'").replace("'", '"'))
+    return np.asarray(values, dtype=np.float32)
+
+
+def exact_search(matrix, sq_norms, queries, k):
+    """
+    Exact k-nearest-neighbour search.
+    Returns (positions, distances), each of shape (len(queries), k).
+    """
+    # ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x, computed with one matrix product
+    q_norms = np.einsum('ij,ij->i', queries, queries)[:, None]
+    squared = q_norms + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(squared, 0.0, out=squared)
+
+    k = min(k, matrix.shape[0])
+    if k == 1:
+        positions = np.argmin(squared, axis=1)[:, None]
+    else:
+        positions = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(squared, positions, axis=1), axis=1)
+        positions = np.take_along_axis(positions, order, axis=1)
+
+    distances = np.sqrt(np.take_along_axis(squared, positions, axis=1))
+    return positions, distances
+
+
+def _sq_norms(matrix):
+    return np.einsum('ij,ij->i', matrix, matrix)
+
+
+def kmeans(data, n_clusters, iterations=20, seed=0):
+    """Plain Lloyd's k-means with k-means++ seeding; returns float32 centroids"""
+    rng = np.random.default_rng(seed)
+    n = data.shape[0]
+
+    centroids = np.empty((n_clusters, data.shape[1]), dtype=np.float32)
+    centroids[0] = data[rng.integers(n)]
+    closest = _sq_norms(data - centroids[0]).astype(np.float64)
+    for c in range(1, n_clusters):
+        total = closest.sum()
+        index = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centroids[c] = data[index]
+        np.minimum(closest, _sq_norms(data - centroids[c]), out=closest)
+
+    for _ in range(iterations):
+        assignment, _ = exact_search(centroids, _sq_norms(centroids), data, 1)
+        assignment = assignment[:, 0]
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Re-seed empty clusters with random points
+            centroids[empty] = data[rng.integers(n, size=int(empty.sum()))]
+
+    return centroids
+
+
+class BruteForceBackend:
+    """Exact linear scan over the whole descriptor matrix"""
+
+    name = 'brute'
+
+    def rebuild(self, matrix, train=True):
+        pass
+
+    def add(self, matrix):
+        pass
+
+    def remove(self, keep):
+        pass
+
+    def search(self, matrix, sq_norms, queries, k):
+        return exact_search(matrix, sq_norms, queries, k)
+
+
+class IVFBackend:
+    """
+    Inverted-file approximate search.
+
+    Descriptors are partitioned into nlist k-means cells; a query only scans
+    the nprobe cells whose centroids are closest to it. Below min_train_size
+    descriptors, or before training, searches fall back to an exact scan.
+    Trained centroids are persisted to path so restarts skip training.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, nlist=256, nprobe=16, min_train_size=4096, path=None, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.path = path
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._assignment = np.empty(0, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(nlist + 1, dtype=np.int64)
+        self._load_centroids()
+
+    def _load_centroids(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as stored:
+                centroids = stored['centroids']
+                trained_size = int(stored['trained_size'])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable IVF index at {self.path}: {str(e)}")
+            return
+        if centroids.shape[0] == self.nlist:
+            self.centroids = centroids.astype(np.float32)
+            self.trained_size = trained_size
+
+    def _save_centroids(self):
+        if not self.path:
+            return
+        # A temporary file per writer, so processes saving at once never share one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                        prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, centroids=self.centroids, trained_size=self.trained_size)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def train(self, matrix):
+        sample = matrix
+        max_sample = self.nlist * 256
+        if len(matrix) > max_sample:
+            rng = np.random.default_rng(self.seed)
+            sample = matrix[rng.choice(len(matrix), max_sample, replace=False)]
+        self.centroids = kmeans(sample, self.nlist, seed=self.seed)
+        self.trained_size = len(matrix)
+        self._save_centroids()
+
+    @property
+    def active(self):
+        return self.centroids is not None and len(self._assignment) >= self.min_train_size
+
+    def _assign(self, vectors):
+        positions, _ = exact_search(self.centroids, _sq_norms(self.centroids), vectors, 1)
+        return positions[:, 0]
+
+    def _reindex(self):
+        self._order = np.argsort(self._assignment, kind='stable')
+        self._offsets = np.searchsorted(self._assignment[self._order], np.arange(self.nlist + 1))
+
+    def _needs_training(self, matrix):
+        # No usable centroids, or the set has grown a lot since training
+        return (self.centroids is None or self.centroids.shape[1] != matrix.shape[1]
+                or len(matrix) > 4 * max(self.trained_size, 1))
+
+    def rebuild(self, matrix, train=True):
+        """
+        Assign every row to a cell. With train=False stale centroids are reloaded
+        from path (saved by whichever process trained them) instead of retrained;
+        without any, searches stay exact.
+        """
+        if len(matrix) >= self.min_train_size and self._needs_training(matrix):
+            if train:
+                self.train(matrix)
+            else:
+                self._load_centroids()
+        if len(matrix) < self.min_train_size or self.centroids is None or self.centroids.shape[1] != matrix.shape[1]:
+            self._assignment = np.zeros(len(matrix), dtype=np.int64)
+            self._reindex()
+            return
+        self._assignment = self._assign(matrix)
+        self._reindex()
+
+    def add(self, matrix):
+        # FaceIndex always appends new descriptors to the end of the matrix
+        if not self.active:
+            self.rebuild(matrix)
+            return
+        new_rows = matrix[len(self._assignment):]
+        self._assignment = np.concatenate([self._assignment, self._assign(new_rows)])
+        self._reindex()
+
+    def remove(self, keep):
+        self._assignment = self._assignment[keep]
+        self._reindex()
+
+    def search(self, matrix, sq_norms, queries, k):
+        if not self.active:
+            return exact_search(matrix, sq_norms, queries, k)
+
+        nprobe = min(self.nprobe, self.nlist)
+        cells, _ = exact_search(self.centroids, _sq_norms(self.centroids), queries, nprobe)
+
+        k = min(k, matrix.shape[0])
+        all_positions = np.zeros((len(queries), k), dtype=np.int64)
+        all_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for row, query in enumerate(queries):
+            candidates = np.concatenate(
+                [self._order[self._offsets[c]:self._offsets[c + 1]] for c in cells[row]])
+            if len(candidates) == 0:
+                continue
+            positions, distances = exact_search(
+                matrix[candidates], sq_norms[candidates], query[None, :], k)
+            found = positions.shape[1]
+            all_positions[row, :found] = candidates[positions[0]]
+            all_distances[row, :found] = distances[0]
+        return all_positions, all_distances
+
+
+def make_backend(name, **options):
+    """Create a search backend by name ('brute' or 'ivf')"""
+    if name == 'brute':
+        return BruteForceBackend()
+    if name == 'ivf':
+        return IVFBackend(**options)
+    raise ValueError(f"Unknown face index backend: {name}")
+
+
+class FaceIndex:
+    """
+    Process-resident index of enrolled face descriptors.
+
+    All descriptors live in one contiguous float32 matrix with a parallel
+    array of Student primary keys, so matching a face is a single batched
+    distance computation instead of a per-student loop over database rows.
+    The search itself is delegated to a backend (exact or approximate).
+    """
+
+    def __init__(self, dim=DESCRIPTOR_DIM, backend=None):
+        self.dim = dim
+        self.backend = backend or BruteForceBackend()
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self.loaded = False
+        # Bumped on every change so derived candidate indexes know when they are stale
+        self.version = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load_matrix(self, matrix, ids, train=True):
+        """
+        Replace the index contents with a prepared (n, dim) matrix and its student ids.
+        train=False makes an approximate backend reuse saved centroids instead of training.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        with self._lock:
+            self._matrix = matrix
+            self._sq_norms = _sq_norms(matrix)
+            self._ids = np.asarray(ids, dtype=np.int64)
+            self.backend.rebuild(matrix, train=train)
+            self.loaded = True
+            self.version += 1
+
+    def add(self, student_pk, descriptor):
+        """Add or replace a student's descriptor; returns False if it has the wrong dimension"""
+        vector = np.asarray(descriptor, dtype=np.float32).reshape(1, -1)
+        if vector.shape[1] != self.dim:
+            return False
+        self.add_many([student_pk], vector)
+        return True
+
+    def add_many(self, student_pks, matrix):
+        """Add or replace several descriptors at once; matrix has one (dim,) row per student"""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32).reshape(-1, self.dim)
+        student_pks = np.asarray(student_pks, dtype=np.int64)
+        with self._lock:
+            # Re-enrolling a student replaces their previous descriptor
+            keep = ~np.isin(self._ids, student_pks)
+            if not keep.all():
+                self._drop(keep)
+            self._matrix = np.vstack([self._matrix, matrix])
+            self._sq_norms = np.append(self._sq_norms, _sq_norms(matrix))
+            self._ids = np.append(self._ids, student_pks)
+            self.backend.add(self._matrix)
+            self.version += 1
+
+    def remove(self, student_pk):
+        with self._lock:
+            keep = self._ids != student_pk
+            if keep.all():
+                return
+            self._drop(keep)
+            self.version += 1
+
+    def _drop(self, keep):
+        self._matrix = self._matrix[keep]
+        self._sq_norms = self._sq_norms[keep]
+        self._ids = self._ids[keep]
+        self.backend.remove(keep)
+
+    def subset(self, student_pks):
+        """
+        Return an exact FaceIndex restricted to the given students (e.g. a class
+        roster), so matching scans O(class size) rows instead of everyone.
+        """
+        with self._lock:
+            keep = np.isin(self._ids, np.asarray(list(student_pks), dtype=np.int64))
+            candidates = FaceIndex(dim=self.dim)
+            candidates.load_matrix(self._matrix[keep], self._ids[keep])
+            candidates.version = self.version
+        return candidates
+
+    def snapshot(self):
+        """Return the current (matrix, ids) pair; both are replaced, never mutated, on update."""
+        with self._lock:
+            return self._matrix, self._ids
+
+    def search_many(self, descriptors, k=1):
+        """
+        Search several descriptors at once.
+        Returns (student_pks, distances), each of shape (len(descriptors), k).
+        Slots without a result are filled with -1 / inf.
+        """
+        queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if len(self._ids) == 0:
+                return (np.full((len(queries), k), -1, dtype=np.int64),
+                        np.full((len(queries), k), np.inf, dtype=np.float32))
+            positions, distances = self.backend.search(self._matrix, self._sq_norms, queries, k)
+            student_pks = np.where(np.isfinite(distances), self._ids[positions], -1)
+        return student_pks, distances
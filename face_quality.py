@@ -0,0 +1,76 @@
+"""
+Enrollment quality: how close each enrolled face is to its nearest neighbour.
+
+Twins or a student enrolled twice produce descriptors so close together that
+a camera capture of one can land nearest the other. scan() finds every
+student's nearest other face (its "margin") and every pair of faces closer
+than a threshold. Distances are computed one block of rows at a time, so the
+N x N distance matrix never exists in memory: memory use is
+max_block_elements floats whatever the number of students.
+"""
+import numpy as np
+
+from face_index import _sq_norms
+
+# About 64 MB of float32 distances per block
+DEFAULT_BLOCK_ELEMENTS = 1 << 24
+
+
+def scan(matrix, pair_distance=None, max_block_elements=DEFAULT_BLOCK_ELEMENTS):
+    """
+    Exact nearest-neighbour scan of a descriptor matrix against itself.
+
+    Returns (neighbours, margins, pairs): for each row the position of the
+    closest other row (-1 if there is none) and its distance (inf), plus a list
+    of (i, j, distance) with i < j for every pair closer than pair_distance.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    n = len(matrix)
+    sq_norms = _sq_norms(matrix)
+    neighbours = np.full(n, -1, dtype=np.int64)
+    margins = np.full(n, np.inf, dtype=np.float32)
+    pairs = []
+    if n < 2:
+        return neighbours, margins, pairs
+
+    block = max(1, max_block_elements // n)
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        rows = np.arange(end - start)
+        squared = sq_norms[start:end, None] + sq_norms[None, :] - 2.0 * (matrix[start:end] @ matrix.T)
+        np.maximum(squared, 0.0, out=squared)
+        # A face is not its own neighbour
+        squared[rows, rows + start] = np.inf
+
+        nearest = np.argmin(squared, axis=1)
+        neighbours[start:end] = nearest
+        margins[start:end] = np.sqrt(squared[rows, nearest])
+
+        if pair_distance:
+            block_rows, columns = np.nonzero(squared < pair_distance * pair_distance)
+            # Each pair is seen from both sides; keep it once
+            keep = block_rows + start < columns
+            block_rows, columns = block_rows[keep], columns[keep]
+            distances = np.sqrt(squared[block_rows, columns])
+            pairs.extend(zip((block_rows + start).tolist(), columns.tolist(), distances.tolist()))
+
+    return neighbours, margins, pairs
+
+
+def needs_runner_up(distances, margins, min_gap):
+    """
+    Classify matches using the stored margins alone.
+
+    A capture at distance d from a student whose nearest enrolled neighbour is
+    margin m away is at least m - d from that neighbour (triangle inequality),
+    so its lead over the runner-up is at least m - 2d and at most m.
+    Returns (ambiguous, unsure): matches that can never lead by min_gap, and
+    matches that need the runner-up distance to decide. NaN margins (never
+    computed) fall in neither.
+    """
+    distances = np.asarray(distances, dtype=np.float32)
+    margins = np.asarray(margins, dtype=np.float32)
+    with np.errstate(invalid='ignore'):
+        ambiguous = margins < min_gap
+        unsure = ~ambiguous & (margins - 2.0 * distances < min_gap)
+    return ambiguous, unsure
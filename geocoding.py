@@ -0,0 +1,217 @@
+"""
+Reverse geocoding of attendance coordinates.
+
+Location names are cached persistently by geohash, so nearby marks share one
+lookup. Lookups run on a small thread pool behind a shared rate limiter, and
+attendance marks queue their coordinates in the background so names are
+usually already cached by the time an admin opens the attendance page.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Shown while a location has not been resolved yet
+PENDING_LOCATION = 'Location lookup pending'
+
+
+def geohash_encode(latitude, longitude, precision=8):
+    """Standard base32 geohash; 8 characters is roughly a 38m x 19m cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            bounds[0] = mid
+        else:
+            bits = bits << 1
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+class NominatimProvider:
+    """OpenStreetMap Nominatim reverse geocoder"""
+
+    def __init__(self, user_agent='attendance_system', timeout=5):
+        from geopy.geocoders import Nominatim
+
+        # One geolocator is reused for every lookup
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def reverse(self, latitude, longitude):
+        location = self.geolocator.reverse(f"{latitude}, {longitude}", language='en')
+        return location.address if location else None
+
+
+class StubProvider:
+    """
+    Offline provider for tests and benchmarks.
+    Returns names from a fixed {geohash: name} mapping, or a synthetic name.
+    """
+
+    def __init__(self, names=None, delay=0.0, precision=8):
+        self.names = names or {}
+        self.delay = delay
+        self.precision = precision
+        self.calls = 0
+
+    def reverse(self, latitude, longitude):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        key = geohash_encode(latitude, longitude, self.precision)
+        return self.names.get(key, f"Stub location {key}")
+
+
+def make_provider(name, **options):
+    """Create a geocoding provider by name ('nominatim' or 'stub')"""
+    if name == 'nominatim':
+        return NominatimProvider(**options)
+    if name == 'stub':
+        return StubProvider(**options)
+    raise ValueError(f"Unknown geocoding provider: {name}")
+
+
+class RateLimiter:
+    """Spaces calls at least min_interval seconds apart across all threads"""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class LocationStore:
+    """Persistent geohash -> name cache backed by a SQLAlchemy model"""
+
+    def __init__(self, app, db, model):
+        self.app = app
+        self.db = db
+        self.model = model
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        with self.app.app_context():
+            rows = self.db.session.query(self.model.geohash, self.model.name).filter(
+                self.model.geohash.in_(list(keys)))
+            return {geohash: name for geohash, name in rows}
+
+    def put(self, key, name, latitude, longitude):
+        with self.app.app_context():
+            try:
+                self.db.session.add(self.model(
+                    geohash=key, name=name, latitude=latitude, longitude=longitude,
+                    created_at=datetime.utcnow()
+                ))
+                self.db.session.commit()
+            except IntegrityError:
+                # Another worker cached the same cell first
+                self.db.session.rollback()
+
+
+class GeocodingService:
+    def __init__(self, provider, store, precision=8, max_workers=4, min_interval=1.0):
+        self.provider = provider
+        self.store = store
+        self.precision = precision
+        self.rate_limiter = RateLimiter(min_interval)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geocoder')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def key(self, latitude, longitude):
+        return geohash_encode(float(latitude), float(longitude), self.precision)
+
+    def _resolve(self, key, latitude, longitude, check_cache):
+        try:
+            if check_cache:
+                cached = self.store.get_many([key])
+                if key in cached:
+                    return cached[key]
+            self.rate_limiter.wait()
+            try:
+                with span('geocode'):
+                    name = self.provider.reverse(latitude, longitude) or 'Location not found'
+            except Exception as e:
+                # Failures are not cached so the cell is retried on a later lookup
+                logger.warning(f"Reverse geocoding failed for {key}: {str(e)}")
+                return None
+            self.store.put(key, name, latitude, longitude)
+            return name
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _submit(self, key, latitude, longitude, check_cache):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._executor.submit(self._resolve, key, latitude, longitude, check_cache)
+                self._in_flight[key] = future
+            return future
+
+    def enqueue(self, latitude, longitude):
+        """Resolve a location in the background (used when attendance is marked)"""
+        if latitude is None or longitude is None:
+            return
+        self._submit(self.key(latitude, longitude), float(latitude), float(longitude), True)
+
+    def lookup_many(self, points, timeout=None):
+        """
+        Resolve many (latitude, longitude) points concurrently.
+        Returns {geohash: name}; points still unresolved after timeout seconds
+        are left out and keep resolving in the background.
+        """
+        keys = {}
+        for latitude, longitude in points:
+            if latitude is None or longitude is None:
+                continue
+            keys.setdefault(self.key(latitude, longitude), (float(latitude), float(longitude)))
+
+        names = self.store.get_many(keys.keys())
+        futures = {key: self._submit(key, *point, False)
+                   for key, point in keys.items() if key not in names}
+        if futures:
+            wait(futures.values(), timeout=timeout)
+        for key, future in futures.items():
+            if future.done() and future.result() is not None:
+                names[key] = future.result()
+        return names
+
+    def lookup(self, latitude, longitude, timeout=None):
+        names = self.lookup_many([(latitude, longitude)], timeout)
+        if latitude is None or longitude is None:
+            return None
+        return names.get(self.key(latitude, longitude))
@@ -0,0 +1,100 @@
+"""
+Classroom geofences compiled once into NumPy vertex arrays.
+
+Classroom.coordinates is a JSON list of "lat,lon" corner strings for a single
+room, or a list of such lists for a classroom made of several rooms (e.g.
+wings of one building). A point is inside the classroom if it is inside any
+of its rooms.
+"""
+import json
+import threading
+
+import numpy as np
+
+
+def parse_corner(corner):
+    lat, lon = map(float, corner.split(','))
+    return lat, lon
+
+
+def parse_rooms(coordinates):
+    """Parse Classroom.coordinates into a list of rooms, each a list of (lat, lon) tuples"""
+    data = json.loads(coordinates) if isinstance(coordinates, str) else coordinates
+    if data and all(isinstance(room, list) for room in data):
+        return [[parse_corner(corner) for corner in room] for room in data]
+    return [[parse_corner(corner) for corner in data]]
+
+
+def _points_in_polygon(vertices, lats, lons):
+    """Even-odd ray casting of many points against one polygon"""
+    x1 = vertices[:, 0][:, None]
+    y1 = vertices[:, 1][:, None]
+    x2 = np.roll(vertices[:, 0], -1)[:, None]
+    y2 = np.roll(vertices[:, 1], -1)[:, None]
+
+    # An edge is crossed if it straddles the point's longitude and the crossing is at or above its latitude
+    straddles = (y1 > lons) != (y2 > lons)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = (x2 - x1) * (lons - y1) / (y2 - y1) + x1
+    crossings = straddles & (lats <= x_cross)
+    return (np.count_nonzero(crossings, axis=0) % 2) == 1
+
+
+class Geofence:
+    def __init__(self, rooms):
+        self.rooms = [np.asarray(room, dtype=np.float64).reshape(-1, 2) for room in rooms if len(room) >= 3]
+        # Per-room bounding boxes as (min_lat, min_lon, max_lat, max_lon) for quick rejection
+        self.boxes = np.array([[*room.min(axis=0), *room.max(axis=0)] for room in self.rooms]).reshape(-1, 4)
+
+    @classmethod
+    def from_coordinates(cls, coordinates):
+        return cls(parse_rooms(coordinates))
+
+    def contains_many(self, points):
+        """
+        Vectorized containment test.
+        points: array-like of shape (n, 2) holding (latitude, longitude)
+        Returns a boolean array of length n.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        inside = np.zeros(len(points), dtype=bool)
+        for vertices, (min_lat, min_lon, max_lat, max_lon) in zip(self.rooms, self.boxes):
+            candidates = np.flatnonzero(
+                ~inside
+                & (points[:, 0] >= min_lat) & (points[:, 0] <= max_lat)
+                & (points[:, 1] >= min_lon) & (points[:, 1] <= max_lon)
+            )
+            if len(candidates):
+                inside[candidates] = _points_in_polygon(
+                    vertices, points[candidates, 0], points[candidates, 1])
+        return inside
+
+    def contains(self, latitude, longitude):
+        return bool(self.contains_many([(latitude, longitude)])[0])
+
+
+class GeofenceCache:
+    """Compiled geofences keyed by classroom id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fences = {}
+
+    def get(self, classroom):
+        with self._lock:
+            cached = self._fences.get(classroom.id)
+        # The coordinates text is kept alongside so an edit made by another process is noticed
+        if cached is not None and cached[0] == classroom.coordinates:
+            return cached[1]
+
+        fence = Geofence.from_coordinates(classroom.coordinates)
+        with self._lock:
+            self._fences[classroom.id] = (classroom.coordinates, fence)
+        return fence
+
+    def invalidate(self, classroom_id=None):
+        with self._lock:
+            if classroom_id is None:
+                self._fences.clear()
+            else:
+                self._fences.pop(classroom_id, None)
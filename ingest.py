@@ -0,0 +1,130 @@
+"""
+Asynchronous attendance ingestion.
+
+The intake endpoint validates a submission, queues it and returns a ticket
+straight away; a pool of worker threads does the matching and database
+write. Clients poll (or stream) the ticket status for the outcome. The queue
+is bounded so overload turns into fast 503 responses instead of piling up
+threads, and its counters show how much work is waiting.
+
+Tickets live in the memory of the process that accepted them, so status
+requests must reach that same process (a single worker or sticky routing).
+Worker threads start with the first submission, not when the pipeline is
+created, so processes that never ingest (CLI commands) do not run them.
+"""
+import queue
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestionPipeline:
+    def __init__(self, process, workers=4, max_queue=1000, result_ttl=300, name='ingest'):
+        self.process = process
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._tickets = {}
+        self._counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self._in_progress = 0
+        self._wait_seconds = 0.0
+        self._process_seconds = 0.0
+        self._workers = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+        self._started = False
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, payload):
+        """Queue a payload and return its ticket; raises QueueFull under back-pressure"""
+        self._start()
+        ticket = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._tickets[ticket] = {'status': 'queued', 'queued_at': time.time()}
+        try:
+            self._queue.put_nowait((ticket, payload))
+        except queue.Full:
+            with self._lock:
+                del self._tickets[ticket]
+                self._counters['rejected'] += 1
+            raise QueueFull('Attendance queue is full, please retry shortly')
+        with self._lock:
+            self._counters['submitted'] += 1
+        return ticket
+
+    def status(self, ticket):
+        """Return a copy of the ticket state, or None if it is unknown or expired"""
+        with self._lock:
+            state = self._tickets.get(ticket)
+            return dict(state) if state else None
+
+    def wait(self, ticket, timeout):
+        """Block until the ticket finishes or timeout seconds pass; returns its state"""
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                state = self._tickets.get(ticket)
+                remaining = deadline - time.time()
+                if state is None or state['status'] in ('done', 'failed') or remaining <= 0:
+                    return dict(state) if state else None
+                self._changed.wait(remaining)
+
+    def metrics(self):
+        with self._lock:
+            finished = self._counters['completed'] + self._counters['failed']
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'in_progress': self._in_progress,
+                'workers': len(self._workers) if self._started else 0,
+                **self._counters,
+                'avg_wait_ms': 1000.0 * self._wait_seconds / finished if finished else 0.0,
+                'avg_process_ms': 1000.0 * self._process_seconds / finished if finished else 0.0,
+            }
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [ticket for ticket, state in self._tickets.items()
+                   if state.get('finished_at', float('inf')) < cutoff]
+        for ticket in expired:
+            del self._tickets[ticket]
+
+    def _run(self):
+        while True:
+            ticket, payload = self._queue.get()
+            started = time.time()
+            with self._changed:
+                state = self._tickets[ticket]
+                state['status'] = 'processing'
+                self._in_progress += 1
+                self._wait_seconds += started - state['queued_at']
+                self._changed.notify_all()
+
+            try:
+                result = self.process(payload)
+                update = {'status': 'done', 'result': result}
+                counter = 'completed'
+            except Exception as e:
+                update = {'status': 'failed', 'error': str(e)}
+                counter = 'failed'
+
+            with self._changed:
+                state.update(update, finished_at=time.time())
+                self._in_progress -= 1
+                self._counters[counter] += 1
+                self._process_seconds += time.time() - started
+                self._changed.notify_all()
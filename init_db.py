@@ -1,15 +1,20 @@
+import sys
+
 from app import app, db
-from datetime import datetime
+from migrations import upgrade
 
-def init_db():
+def init_db(reset=False):
     with app.app_context():
-        # Drop all existing tables
-        db.drop_all()
+        if reset:
+            # Drop all existing tables (destroys every record)
+            db.drop_all()
         
-        # Create all tables with new schema
+        # Create missing tables, then bring existing ones up to the current schema
         db.create_all()
+        upgrade(db.engine)
         
         print("Database initialized with new schema")
 
 if __name__ == '__main__':
-    init_db() 
\ No newline at end of file
+    # Pass --reset to start from an empty database
+    init_db(reset='--reset' in sys.argv[1:])
@@ -0,0 +1,152 @@
+"""
+In-place schema migrations for an existing attendance database.
+
+Each migration runs once and is recorded in the schema_migrations table.
+Migrations are written to be safe on a database freshly created by
+db.create_all(), where the new columns already exist.
+
+Usage:
+    python migrations.py
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Float, Integer, LargeBinary, MetaData, String, Table,
+                        inspect, select, text)
+
+from face_index import encode_descriptor, parse_face_encoding
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime),
+)
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def _add_column(conn, table, column, column_type, constraints=''):
+    """ALTER TABLE ... ADD COLUMN with the type spelled for the connection's dialect"""
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(
+        f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} '
+        f'{column_type.compile(dialect=conn.dialect)}{constraints}'
+    ))
+
+
+def binary_face_embeddings(conn):
+    """Move JSON face encodings into the compact binary face_embedding column"""
+    if 'face_embedding' not in _columns(conn, 'student'):
+        _add_column(conn, 'student', 'face_embedding', LargeBinary())
+
+    rows = conn.execute(text(
+        'SELECT id, face_encoding FROM student '
+        'WHERE face_embedding IS NULL AND face_encoding IS NOT NULL'
+    )).fetchall()
+
+    converted = 0
+    for student_pk, face_encoding in rows:
+        try:
+            blob = encode_descriptor(parse_face_encoding(face_encoding))
+        except Exception as e:
+            logger.warning(f"Leaving unreadable face encoding for student {student_pk} as text: {str(e)}")
+            continue
+        conn.execute(
+            text('UPDATE student SET face_embedding = :blob, face_encoding = NULL WHERE id = :id'),
+            {'blob': blob, 'id': student_pk}
+        )
+        converted += 1
+    logger.info(f"Converted {converted} face encodings to binary")
+
+
+def attendance_indexes(conn):
+    """Index attendance lookups and allow only one mark per student per session"""
+    # Keep the first mark of any duplicates so the unique index can be created
+    removed = conn.execute(text(
+        'DELETE FROM attendance WHERE id NOT IN ('
+        'SELECT MIN(id) FROM attendance GROUP BY session_id, student_id)'
+    )).rowcount
+    if removed:
+        logger.info(f"Removed {removed} duplicate attendance marks")
+
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_session_student '
+        'ON attendance (session_id, student_id)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_attendance_student_timestamp '
+        'ON attendance (student_id, timestamp)'
+    ))
+
+
+def face_margins(conn):
+    """Store each student's distance to the closest other enrolled face"""
+    columns = _columns(conn, 'student')
+    if 'face_margin' not in columns:
+        _add_column(conn, 'student', 'face_margin', Float())
+    if 'face_neighbor_id' not in columns:
+        _add_column(conn, 'student', 'face_neighbor_id', Integer())
+
+
+def attendance_client_keys(conn):
+    """Idempotency keys so submissions replayed by offline clients are recorded once"""
+    if 'client_key' not in _columns(conn, 'attendance'):
+        _add_column(conn, 'attendance', 'client_key', String(64))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_client_key ON attendance (client_key)'
+    ))
+
+
+def roster_versions(conn):
+    """Roster change counters, so every worker can tell when its cached roster index is stale"""
+    for table in ('classroom', 'session'):
+        if 'roster_version' not in _columns(conn, table):
+            _add_column(conn, table, 'roster_version', Integer(), ' NOT NULL DEFAULT 0')
+    # Sessions that already have their own roster must not share their classroom's index
+    conn.execute(text(
+        'UPDATE session SET roster_version = 1 WHERE roster_version = 0 AND id IN ('
+        'SELECT session_id FROM enrollment WHERE session_id IS NOT NULL)'
+    ))
+
+
+# (version, description, function) in the order they must be applied
+MIGRATIONS = [
+    (1, 'binary face embeddings', binary_face_embeddings),
+    (2, 'attendance indexes', attendance_indexes),
+    (3, 'face margins', face_margins),
+    (4, 'attendance client keys', attendance_client_keys),
+    (5, 'roster versions', roster_versions),
+]
+
+
+def upgrade(engine):
+    """Apply every migration that has not yet been recorded"""
+    with engine.begin() as conn:
+        metadata.create_all(conn)
+        applied = {version for (version,) in conn.execute(select(schema_migrations.c.version))}
+
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        # One transaction per migration so a failure leaves earlier ones applied
+        with engine.begin() as conn:
+            logger.info(f"Applying migration {version}: {name}")
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow()))
+
+
+if __name__ == '__main__':
+    from app import app, db
+
+    with app.app_context():
+        db.create_all()
+        upgrade(db.engine)
+        print("Database is up to date")
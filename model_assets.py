@@ -0,0 +1,193 @@
+"""
+Fingerprinted face-api.js model files.
+
+face-api.js loads a model from its weights manifest and then fetches the shard
+files that manifest lists. build() checks every model in the source directory
+against the byte sizes its manifest implies, copies the complete ones into an
+output directory under content-hashed names (rewriting each weights manifest to
+point at the hashed shards, then hashing the manifest itself), and writes gzip
+and, when the brotli module is installed, brotli variants next to each file.
+assets.json maps the original names to the built files. A hashed name changes
+whenever its bytes do, so browsers may cache these files forever.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_MANIFEST = 'assets.json'
+MANIFEST_SUFFIX = '-weights_manifest.json'
+
+# Preferred first when a client accepts both
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_DTYPE_BYTES = {'float32': 4, 'int32': 4, 'uint16': 2, 'uint8': 1}
+
+
+def model_names(models_dir):
+    """Models with a weights manifest in models_dir"""
+    return sorted(name[:-len(MANIFEST_SUFFIX)] for name in os.listdir(models_dir)
+                  if name.endswith(MANIFEST_SUFFIX))
+
+
+def shard_paths(weights_manifest):
+    return [path for group in weights_manifest for path in group['paths']]
+
+
+def expected_group_bytes(weights_manifest):
+    """Bytes each group's shards must add up to, from its weight shapes and (quantized) dtypes"""
+    sizes = []
+    for group in weights_manifest:
+        total = 0
+        for weight in group['weights']:
+            dtype = (weight.get('quantization') or weight).get('dtype', 'float32')
+            count = 1
+            for dimension in weight['shape']:
+                count *= dimension
+            total += count * _DTYPE_BYTES[dtype]
+        sizes.append(total)
+    return sizes
+
+
+def read_weights_manifest(models_dir, model):
+    with open(os.path.join(models_dir, model + MANIFEST_SUFFIX)) as f:
+        return json.load(f)
+
+
+def verify_model(models_dir, model):
+    """Problems with one model's files as a list of messages; empty when it is complete"""
+    try:
+        weights_manifest = read_weights_manifest(models_dir, model)
+        expected = expected_group_bytes(weights_manifest)
+    except (OSError, ValueError, KeyError) as e:
+        return [f"{model}{MANIFEST_SUFFIX} is unreadable: {e}"]
+
+    problems = []
+    for group, expected_bytes in zip(weights_manifest, expected):
+        missing = [path for path in group['paths'] if not os.path.isfile(os.path.join(models_dir, path))]
+        if missing:
+            problems.extend(f"{path} is missing" for path in missing)
+            continue
+        actual_bytes = sum(os.path.getsize(os.path.join(models_dir, path)) for path in group['paths'])
+        if actual_bytes != expected_bytes:
+            problems.append(f"{', '.join(group['paths'])} hold {actual_bytes} bytes, the manifest needs {expected_bytes}")
+    return problems
+
+
+def _put(path, data):
+    """Write a file atomically so a serving process never reads half of it"""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _write_asset(output_dir, name, data, written):
+    """Write data under a content-hashed name plus its compressed variants; returns the asset entry"""
+    digest = hashlib.sha256(data).hexdigest()
+    stem, extension = os.path.splitext(name) if name.endswith('.json') else (name, '')
+    hashed = f"{stem}.{digest[:16]}{extension}"
+    _put(os.path.join(output_dir, hashed), data)
+    written.add(hashed)
+
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    entry = {'path': hashed, 'sha256': digest, 'size': len(data), 'encodings': {}}
+    for encoding, suffix in ENCODINGS:
+        # Float weights barely compress; only keep variants that save bytes
+        if encoding in variants and len(variants[encoding]) < len(data):
+            _put(os.path.join(output_dir, hashed + suffix), variants[encoding])
+            written.add(hashed + suffix)
+            entry['encodings'][encoding] = hashed + suffix
+    return entry
+
+
+def build(models_dir, output_dir):
+    """
+    Fingerprint and precompress every complete model.
+
+    Returns (manifest, problems): the assets.json content, with 'models'
+    mapping each model to its hashed weights manifest and 'assets' mapping
+    every original file name to its entry, and {model: [messages]} for the
+    models that were left out. Files from earlier builds are removed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'models': {}, 'assets': {}}
+    problems = {}
+    written = set()
+
+    for model in model_names(models_dir):
+        model_problems = verify_model(models_dir, model)
+        if model_problems:
+            problems[model] = model_problems
+            continue
+
+        weights_manifest = read_weights_manifest(models_dir, model)
+        for group in weights_manifest:
+            hashed_paths = []
+            for path in group['paths']:
+                with open(os.path.join(models_dir, path), 'rb') as f:
+                    entry = _write_asset(output_dir, path, f.read(), written)
+                manifest['assets'][path] = entry
+                hashed_paths.append(entry['path'])
+            group['paths'] = hashed_paths
+
+        data = json.dumps(weights_manifest, separators=(',', ':')).encode()
+        entry = _write_asset(output_dir, model + MANIFEST_SUFFIX, data, written)
+        manifest['assets'][model + MANIFEST_SUFFIX] = entry
+        manifest['models'][model] = entry['path']
+
+    # assets.json is replaced last, so servers switch to the new build in one step
+    _put(os.path.join(output_dir, ASSET_MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    for name in os.listdir(output_dir):
+        if name not in written and name != ASSET_MANIFEST:
+            os.remove(os.path.join(output_dir, name))
+    return manifest, problems
+
+
+class ModelAssets:
+    """The current build's assets.json, reloaded when a new build replaces it"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._manifest = {'models': {}, 'assets': {}}
+        self._by_path = {}
+
+    def manifest(self):
+        path = os.path.join(self.directory, ASSET_MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                manifest = {'models': {}, 'assets': {}}
+                if mtime is not None:
+                    try:
+                        with open(path) as f:
+                            manifest = json.load(f)
+                    except (OSError, ValueError) as e:
+                        logger.error(f"Could not read {path}: {e}")
+                self._by_path = {entry['path']: entry for entry in manifest['assets'].values()}
+                self._manifest, self._mtime = manifest, mtime
+        return self._manifest
+
+    def lookup(self, filename):
+        """The asset entry for a fingerprinted file name, or None"""
+        self.manifest()
+        return self._by_path.get(filename)
+
+    def file_path(self, filename):
+        return os.path.join(self.directory, filename)
@@ -0,0 +1,120 @@
+"""
+Content-addressed cache of rendered session QR codes.
+
+Images are keyed by a hash of (format, box size, encoded URL), kept in a
+small in-memory LRU and on disk, and rendered on a background thread pool so
+request threads only wait for images that are not cached yet.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+
+from instrumentation import span
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def render_qr(data, fmt='png', box_size=10):
+    """Render data as a QR code image and return the encoded bytes"""
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    if fmt == 'svg':
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+
+    buffered = BytesIO()
+    if fmt == 'svg':
+        img.save(buffered)
+    else:
+        img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+class QRCodeCache:
+    def __init__(self, directory, max_entries=256, max_workers=2):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='qr')
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(data, fmt, box_size):
+        return hashlib.sha256(f"{fmt}:{box_size}:{data}".encode()).hexdigest()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def _remember(self, key, content):
+        with self._lock:
+            self._memory[key] = content
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _render(self, key, data, fmt, box_size):
+        try:
+            with span('qr_render'):
+                content = render_qr(data, fmt, box_size)
+            # Write then rename so readers never see a partial file
+            path = self._path(key, fmt)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._remember(key, content)
+            return content
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _lookup(self, key, fmt):
+        with self._lock:
+            content = self._memory.get(key)
+            if content is not None:
+                self._memory.move_to_end(key)
+                return content
+        try:
+            with open(self._path(key, fmt), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, content)
+        return content
+
+    def _submit(self, key, data, fmt, box_size):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, key, data, fmt, box_size)
+                self._in_flight[key] = future
+            return future
+
+    def get(self, data, fmt='png', box_size=10):
+        """Return (content, key) for a QR code, rendering it if needed"""
+        key = self.key(data, fmt, box_size)
+        content = self._lookup(key, fmt)
+        if content is None:
+            content = self._submit(key, data, fmt, box_size).result()
+        return content, key
+
+    def prefetch(self, data, fmt='png', box_size=10):
+        """Render a QR code in the background if it is not cached yet"""
+        key = self.key(data, fmt, box_size)
+        if not os.path.exists(self._path(key, fmt)):
+            return self._submit(key, data, fmt, box_size)
+        return None
@@ -0,0 +1,92 @@
+"""
+Face descriptor matrix shared between worker processes.
+
+The matrix is published as memory-mapped .npy files under one directory,
+versioned by a generation counter. Every worker maps the current generation
+read-only, so the descriptors occupy the page cache once however many workers
+run, and a starting worker maps the files instead of reading the database.
+A worker that changes the student set publishes a new generation; the others
+notice the bumped counter on their next match and remap.
+"""
+import glob
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: publishing is not serialised across processes
+    fcntl = None
+
+
+class SharedFaceMatrix:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._generation_path = os.path.join(directory, 'generation')
+        self._lock_path = os.path.join(directory, 'publish.lock')
+
+    def _paths(self, generation):
+        return (os.path.join(self.directory, f"matrix.{generation}.npy"),
+                os.path.join(self.directory, f"ids.{generation}.npy"))
+
+    def current_generation(self):
+        """The latest published generation, or None if nothing was published yet"""
+        try:
+            with open(self._generation_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @contextmanager
+    def publishing(self):
+        """Hold the cross-process publish lock"""
+        with open(self._lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, matrix, ids):
+        """Write a new generation and make it current; call inside publishing()"""
+        generation = (self.current_generation() or 0) + 1
+        matrix_path, ids_path = self._paths(generation)
+        for path, array in ((matrix_path, np.ascontiguousarray(matrix, dtype=np.float32)),
+                            (ids_path, np.asarray(ids, dtype=np.int64))):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+        tmp_path = self._generation_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self._generation_path)
+
+        self._remove_old(generation)
+        return generation
+
+    def _remove_old(self, generation):
+        # Workers still mapping an older generation keep their pages until they remap
+        for path in glob.glob(os.path.join(self.directory, '*.npy')):
+            try:
+                file_generation = int(os.path.basename(path).split('.')[1])
+            except (IndexError, ValueError):
+                continue
+            if file_generation < generation - 1:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still mapped by a worker on a platform that forbids removing it
+                    pass
+
+    def load(self, generation):
+        """Map a generation read-only; returns (matrix, ids) without copying the matrix"""
+        matrix_path, ids_path = self._paths(generation)
+        matrix = np.load(matrix_path, mmap_mode='r')
+        ids = np.load(ids_path)
+        return matrix, ids
@@ -0,0 +1,100 @@
+// IndexedDB outbox for attendance submissions made while the network is down.
+// Shared by the attendance page and the service worker, which flushes it when
+// background sync reports connectivity. Every submission carries a client_key,
+// so the server records a replayed submission only once.
+(function (global) {
+    const DB_NAME = 'attendance-outbox';
+    const STORE = 'submissions';
+    const SYNC_URL = '/api/attendance/sync';
+    const BATCH_SIZE = 50;
+
+    function openDb() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = () => request.result.createObjectStore(STORE, { keyPath: 'client_key' });
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async function withStore(mode, work) {
+        const db = await openDb();
+        return new Promise((resolve, reject) => {
+            const transaction = db.transaction(STORE, mode);
+            const request = work(transaction.objectStore(STORE));
+            transaction.oncomplete = () => {
+                db.close();
+                resolve(request ? request.result : undefined);
+            };
+            transaction.onerror = () => {
+                db.close();
+                reject(transaction.error);
+            };
+        });
+    }
+
+    function newClientKey() {
+        if (global.crypto && global.crypto.randomUUID) {
+            return global.crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+    }
+
+    async function flushOnce() {
+        const pending = await AttendanceOutbox.all();
+        const results = [];
+        for (let start = 0; start < pending.length; start += BATCH_SIZE) {
+            const response = await fetch(SYNC_URL, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ items: pending.slice(start, start + BATCH_SIZE) })
+            });
+            if (!response.ok) {
+                throw new Error(`Attendance sync failed with status ${response.status}`);
+            }
+            const body = await response.json();
+            // Items the server asks to retry stay queued; the rest have their final outcome
+            const finished = body.results.filter(result => !result.retry && result.client_key)
+                .map(result => result.client_key);
+            await AttendanceOutbox.remove(finished);
+            results.push(...body.results);
+        }
+        return results;
+    }
+
+    let flushing = null;
+
+    const AttendanceOutbox = {
+        newClientKey,
+
+        add(submission) {
+            return withStore('readwrite', store => store.put(submission));
+        },
+
+        all() {
+            return withStore('readonly', store => store.getAll());
+        },
+
+        count() {
+            return withStore('readonly', store => store.count());
+        },
+
+        remove(clientKeys) {
+            return withStore('readwrite', store => {
+                clientKeys.forEach(clientKey => store.delete(clientKey));
+            });
+        },
+
+        // Send everything queued in batches; resolves with the server's results
+        flush() {
+            if (!flushing) {
+                flushing = flushOnce().finally(() => {
+                    flushing = null;
+                });
+            }
+            return flushing;
+        }
+    };
+
+    global.AttendanceOutbox = AttendanceOutbox;
+})(self);
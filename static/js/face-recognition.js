@@ -10,12 +10,14 @@ async function loadModels() {
         }
         
         const MODEL_URL = '/static/models';
+        // Fingerprinted manifest URLs from the model asset build, when there is one
+        const modelUrl = (name) => (window.MODEL_URLS || {})[name] || MODEL_URL;
         
         // Preload models in the background
         const modelPromises = [
-            faceapi.nets.tinyFaceDetector.loadFromUri(MODEL_URL),
-            faceapi.nets.faceLandmark68Net.loadFromUri(MODEL_URL),
-            faceapi.nets.faceRecognitionNet.loadFromUri(MODEL_URL)
+            faceapi.nets.tinyFaceDetector.loadFromUri(modelUrl('tiny_face_detector_model')),
+            faceapi.nets.faceLandmark68Net.loadFromUri(modelUrl('face_landmark_68_model')),
+            faceapi.nets.faceRecognitionNet.loadFromUri(modelUrl('face_recognition_model'))
         ];
         
         await Promise.all(modelPromises);
@@ -0,0 +1,125 @@
+"""
+Database engine tuning and write batching.
+
+SQLite is tuned for many concurrent readers and short write transactions
+(WAL journal, relaxed fsync, busy timeout instead of immediate "database is
+locked" errors). The same models run unchanged on PostgreSQL by pointing
+DATABASE_URL at it.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy import event
+
+
+def database_uri(default_uri, environ):
+    """Use DATABASE_URL when set (e.g. a PostgreSQL server), otherwise the default SQLite file"""
+    uri = environ.get('DATABASE_URL') or default_uri
+    # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri, pool_size=10, max_overflow=20, pool_timeout=30, busy_timeout_ms=5000):
+    """SQLALCHEMY_ENGINE_OPTIONS suited to the database behind uri"""
+    if uri.startswith('sqlite'):
+        return {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'connect_args': {
+                # Connections are handed between request and worker threads by the pool
+                'check_same_thread': False,
+                'timeout': busy_timeout_ms / 1000.0,
+            },
+        }
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_pre_ping': True,
+    }
+
+
+def configure_sqlite(engine, journal_mode='WAL', synchronous='NORMAL', busy_timeout_ms=5000):
+    """Apply SQLite pragmas to every new connection of engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.close()
+
+
+class WriteBehindQueue:
+    """
+    Groups writes from concurrent requests into small batched transactions.
+
+    submit() returns a Future. A background thread collects items until
+    max_batch are waiting or max_latency seconds have passed since the first
+    one, then hands the whole group to flush(items), which must write them in
+    one transaction and return one result per item.
+    """
+
+    def __init__(self, flush, max_batch=50, max_latency=0.05, name='write-behind'):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Flush what we have, then stop
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.flush(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self, timeout=5):
+        """Flush everything queued so far and stop the background thread"""
+        self._queue.put(None)
+        self._thread.join(timeout)
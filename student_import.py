@@ -0,0 +1,181 @@
+"""
+Bulk student enrollment.
+
+An import file lists student_id, name and face_descriptor per student, as CSV
+(face_descriptor holding a JSON array) or NDJSON. The whole file is checked
+at once: descriptors are stacked into one matrix for the dimension and NaN
+checks, student IDs are compared in a single pass against the file itself and
+the database, and faces are searched against the enrolled set (and each other)
+with batched matrix products. Every rejected row is reported with its line
+number and reason; the accepted rows can then be inserted in batches.
+"""
+import csv
+import io
+import json
+import re
+
+import numpy as np
+
+from face_index import _sq_norms
+
+FORMATS = ('csv', 'ndjson')
+
+STUDENT_ID_PATTERN = re.compile(r'^\d{10}$')
+
+# Rows of the file compared against each other per matrix product
+_SELF_SEARCH_BLOCK = 1024
+
+
+def detect_format(filename=None, content_type=None, default='csv'):
+    """Pick 'csv' or 'ndjson' from a file name or content type"""
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    if filename.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    return default
+
+
+def read_rows(text, fmt):
+    """
+    Parse an import file into dicts with line, student_id, name and
+    face_descriptor keys. Lines that cannot be parsed carry an 'error' instead.
+    """
+    rows = []
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        for record in reader:
+            row = {
+                'line': reader.line_num,
+                'student_id': (record.get('student_id') or '').strip(),
+                'name': (record.get('name') or '').strip(),
+                'face_descriptor': None
+            }
+            descriptor = (record.get('face_descriptor') or '').strip().strip("'")
+            try:
+                row['face_descriptor'] = json.loads(descriptor) if descriptor else None
+            except ValueError:
+                row['error'] = 'face_descriptor is not a JSON array'
+            rows.append(row)
+        return rows
+
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError
+        except ValueError:
+            rows.append({'line': line_number, 'student_id': '', 'name': '', 'error': 'Line is not a JSON object'})
+            continue
+        rows.append({
+            'line': line_number,
+            'student_id': str(record.get('student_id') or '').strip(),
+            'name': str(record.get('name') or '').strip(),
+            'face_descriptor': record.get('face_descriptor')
+        })
+    return rows
+
+
+def _descriptor_matrix(rows, dim):
+    """Stack well-formed descriptors; returns (matrix, positions) and sets row errors"""
+    positions = []
+    for position, row in enumerate(rows):
+        if 'error' in row:
+            continue
+        descriptor = row['face_descriptor']
+        if not isinstance(descriptor, list) or not descriptor:
+            row['error'] = 'face_descriptor is required'
+        elif len(descriptor) != dim:
+            row['error'] = f"face_descriptor must have {dim} values"
+        else:
+            positions.append(position)
+
+    try:
+        matrix = np.array([rows[position]['face_descriptor'] for position in positions], dtype=np.float32)
+    except (TypeError, ValueError):
+        # Some descriptor holds a non-number; find which ones one by one
+        numeric = []
+        for position in positions:
+            try:
+                np.asarray(rows[position]['face_descriptor'], dtype=np.float32)
+                numeric.append(position)
+            except (TypeError, ValueError):
+                rows[position]['error'] = 'face_descriptor must contain only numbers'
+        positions = numeric
+        matrix = np.array([rows[position]['face_descriptor'] for position in positions], dtype=np.float32)
+    matrix = matrix.reshape(-1, dim)
+
+    finite = np.isfinite(matrix).all(axis=1)
+    for position in np.asarray(positions, dtype=np.int64)[~finite]:
+        rows[position]['error'] = 'face_descriptor contains NaN or infinite values'
+    return matrix[finite], [position for position, ok in zip(positions, finite) if ok]
+
+
+def check_descriptor(descriptor, dim):
+    """Validate one face descriptor with the same rules as an import row; returns (vector, error)"""
+    row = {'face_descriptor': descriptor}
+    matrix, positions = _descriptor_matrix([row], dim)
+    return (matrix[0], None) if positions else (None, row['error'])
+
+
+def _nearest_earlier_rows(matrix, threshold):
+    """For each row, the closest earlier row holding the same face (distance under threshold), or -1"""
+    sq_norms = _sq_norms(matrix)
+    earlier = np.full(len(matrix), -1, dtype=np.int64)
+    for start in range(0, len(matrix), _SELF_SEARCH_BLOCK):
+        end = min(start + _SELF_SEARCH_BLOCK, len(matrix))
+        rows = np.arange(start, end)
+        squared = sq_norms[start:end, None] + sq_norms[None, :end] - 2.0 * (matrix[start:end] @ matrix[:end].T)
+        # Only rows listed before each query count, so the first of a pair is the one kept
+        squared[np.arange(end)[None, :] >= rows[:, None]] = np.inf
+        nearest = np.argmin(squared, axis=1)
+        close = np.sqrt(np.maximum(squared[np.arange(len(rows)), nearest], 0.0)) < threshold
+        earlier[rows[close]] = nearest[close]
+    return earlier
+
+
+def validate(rows, dim, existing_student_ids, search_enrolled, threshold):
+    """
+    Check every row at once.
+
+    existing_student_ids(ids) returns the subset of ids already in the database;
+    search_enrolled(matrix) returns, for each row, the (student_id, distance)
+    of the nearest enrolled face, or (None, inf) when nobody is enrolled.
+    Returns (accepted, errors): accepted is a list of (row, descriptor) pairs,
+    errors a list of {'line', 'student_id', 'error'} dicts in file order.
+    """
+    first_line = {}
+    for row in rows:
+        if 'error' in row:
+            continue
+        if not STUDENT_ID_PATTERN.match(row['student_id']):
+            row['error'] = 'Invalid student ID format. Must be 10 digits'
+        elif row['student_id'] in first_line:
+            row['error'] = f"Duplicate student ID (first listed on line {first_line[row['student_id']]})"
+        else:
+            first_line[row['student_id']] = row['line']
+
+    already_enrolled = existing_student_ids(list(first_line))
+    for row in rows:
+        if 'error' not in row and row['student_id'] in already_enrolled:
+            row['error'] = 'Student ID already exists'
+
+    matrix, positions = _descriptor_matrix(rows, dim)
+
+    if len(positions):
+        for position, (student_id, distance) in zip(positions, search_enrolled(matrix)):
+            if student_id is not None and distance < threshold:
+                rows[position]['error'] = f"Face matches enrolled student {student_id} (distance {distance:.3f})"
+
+        for position, earlier in zip(positions, _nearest_earlier_rows(matrix, threshold)):
+            if earlier >= 0 and 'error' not in rows[position]:
+                rows[position]['error'] = f"Face matches line {rows[positions[earlier]]['line']} of this file"
+
+    accepted = [(rows[position], vector) for position, vector in zip(positions, matrix)
+                if 'error' not in rows[position]]
+    errors = [{'line': row['line'], 'student_id': row['student_id'], 'error': row['error']}
+              for row in rows if 'error' in row]
+    return accepted, errors
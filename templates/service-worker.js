@@ -0,0 +1,101 @@
+// Rendered by the service_worker route. The cache version is derived from the
+// precached files, so changing any model or script installs a new worker that
+// fills a fresh cache and drops the old ones.
+const CACHE_VERSION = {{ cache_version|tojson }};
+const PRECACHE = `attendance-precache-${CACHE_VERSION}`;
+const RUNTIME = `attendance-runtime-${CACHE_VERSION}`;
+const PRECACHE_URLS = {{ precache_urls|tojson }};
+const OUTBOX_SYNC_TAG = 'attendance-outbox';
+
+importScripts({{ outbox_url|tojson }});
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(PRECACHE)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name !== PRECACHE && name !== RUNTIME).map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function cacheFirst(request, cacheName) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok || response.type === 'opaque') {
+        const cache = await caches.open(cacheName);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function networkFirst(request) {
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            const cache = await caches.open(RUNTIME);
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await caches.match(request);
+        if (cached) {
+            return cached;
+        }
+        throw error;
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(request.url);
+
+    if (url.origin === self.location.origin) {
+        if (PRECACHE_URLS.includes(url.pathname)) {
+            // Model files and scripts: served from the precache
+            event.respondWith(cacheFirst(request, PRECACHE));
+        } else if (request.mode === 'navigate') {
+            // Pages: fresh when online, the last copy when offline
+            event.respondWith(networkFirst(request));
+        }
+        // Everything else (APIs, QR codes) always goes to the network
+        return;
+    }
+
+    // CDN scripts (Tailwind, TensorFlow.js, face-api.js) are cached on first use
+    event.respondWith(cacheFirst(request, RUNTIME));
+});
+
+async function flushOutbox() {
+    const results = await AttendanceOutbox.flush();
+    if (results.length) {
+        const clients = await self.clients.matchAll({ type: 'window' });
+        clients.forEach(client => client.postMessage({ type: 'outbox-flushed', results }));
+    }
+}
+
+self.addEventListener('sync', event => {
+    if (event.tag === OUTBOX_SYNC_TAG) {
+        event.waitUntil(flushOutbox());
+    }
+});
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'flush-outbox') {
+        event.waitUntil(flushOutbox());
+    }
+});